@@ -0,0 +1,211 @@
+"""Offline end-to-end benchmark of the Wetterbericht against a local stub server for every provider
+
+Every scenario runs in a fresh process, so imports and connection setup are part of the measurement and the
+peak RSS belongs to that scenario only. The results are printed (or written) as JSON and can be compared
+against a previous result to gate regressions.
+"""
+import json
+import logging
+import re
+import resource
+import statistics
+import sys
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from time import perf_counter, process_time
+
+repo_dir = Path(__file__).parent.parent
+# Only the directory of the script is on the path, 'mswetterbericht' is imported from this checkout
+sys.path.insert(0, str(repo_dir))
+
+from stub_server import StubServer, fixtures_dir
+
+default_instruments_file = fixtures_dir / "instruments.yaml"
+default_prose_file = repo_dir / "files" / "prose.yaml"
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--instruments-file", default=default_instruments_file)
+    parser.add_argument("--prose-file", default=default_prose_file)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per scenario, the median is used"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="Only run these scenarios ('forecast', 'weather' or 'provider:<name>')",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds per stub response"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of stub responses failing with HTTP 503",
+    )
+    parser.add_argument(
+        "--cnbc-format", choices=("json", "xml", "mixed"), default="json"
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=300, help="Size of scraped pages in KiB"
+    )
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument(
+        "--baseline", help="Results of a previous run to check for regressions"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Allowed relative wall time increase per scenario compared to the baseline",
+    )
+    return parser.parse_args()
+
+
+def count_error_lines(text: str, error_line: str) -> int:
+    """Count the lines of text rendered with the error line, recognised by its longest part without fields"""
+    marker = max(re.split(r"\{[^}]*}", error_line), key=len).strip()
+    return sum(1 for line in text.splitlines() if marker in line)
+
+
+def run_scenario(
+    scenario: str,
+    instruments_file: str,
+    prose_file: str,
+    redirected_hosts: dict,
+    repeat: int,
+) -> dict:
+    """Run a scenario repeatedly, executed in a fresh process"""
+    from ruamel.yaml import YAML
+
+    from mswetterbericht import wetterbericht
+    from mswetterbericht.lib import web
+
+    logging.getLogger().setLevel(logging.WARNING)
+    wetterbericht.logger.setLevel(logging.WARNING)
+    web.redirected_hosts.update(redirected_hosts)
+
+    with open(instruments_file) as f:
+        instruments_data = YAML(typ="safe").load(f)
+    if scenario.startswith("provider:"):
+        provider = scenario.split(":", 1)[1]
+        instruments_data["instruments"] = {
+            provider: instruments_data["instruments"][provider]
+        }
+
+    wall_times = []
+    cpu_times = []
+    error_lines = 0
+    for _ in range(repeat):
+        wall_start = perf_counter()
+        cpu_start = process_time()
+        if scenario == "forecast":
+            forecast = wetterbericht.forecast(
+                instruments_file=instruments_file, prose_file=prose_file
+            )
+            error_lines = count_error_lines(
+                forecast, instruments_data["lines"]["error"]
+            )
+        elif scenario == "weather":
+            wetterbericht.create_weather_line(instruments_data["lines"]["weather"])
+        else:
+            instruments = wetterbericht.create_instruments(instruments_data)
+            error_lines = sum(
+                1 for i in instruments if i.values.absolute_value == -1337
+            )
+        cpu_times.append(process_time() - cpu_start)
+        wall_times.append(perf_counter() - wall_start)
+
+    return {
+        "wall_time": statistics.median(wall_times),
+        "wall_times": wall_times,
+        "cpu_time": statistics.median(cpu_times),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "error_lines": error_lines,
+    }
+
+
+def check_regressions(results: dict, baseline: dict, max_regression: float) -> list:
+    """Compare the wall times of all scenarios against the baseline"""
+    regressions = []
+    for scenario, result in results["scenarios"].items():
+        if (previous := baseline["scenarios"].get(scenario)) is None:
+            continue
+        allowed = previous["wall_time"] * (1 + max_regression)
+        if result["wall_time"] > allowed:
+            regressions.append(
+                f"{scenario}: {result['wall_time']:.3f}s > {allowed:.3f}s "
+                f"(baseline {previous['wall_time']:.3f}s)"
+            )
+    return regressions
+
+
+def main() -> int:
+    args = parse_args()
+    from ruamel.yaml import YAML
+
+    with open(args.instruments_file) as f:
+        providers = list(YAML(typ="safe").load(f)["instruments"])
+    scenarios = args.scenario or (
+        ["forecast", "weather"] + [f"provider:{provider}" for provider in providers]
+    )
+
+    server = StubServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        cnbc_format=args.cnbc_format,
+        page_size=args.page_size * 1024,
+    ).start()
+    results = {
+        "settings": {
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "cnbc_format": args.cnbc_format,
+            "page_size_kib": args.page_size,
+        },
+        "scenarios": {},
+    }
+    for scenario in scenarios:
+        server.reset_counters()
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as p:
+            result = p.submit(
+                run_scenario,
+                scenario,
+                str(args.instruments_file),
+                str(args.prose_file),
+                server.redirected_hosts,
+                args.repeat,
+            ).result()
+        result["requests"] = dict(server.request_counts)
+        result["response_bytes"] = dict(server.response_bytes)
+        results["scenarios"][scenario] = result
+        print(
+            f"{scenario:<45} wall {result['wall_time']:.3f}s  cpu {result['cpu_time']:.3f}s  "
+            f"rss {result['peak_rss_kib'] / 1024:.1f}MiB  "
+            f"requests {sum(result['requests'].values())}",
+            file=sys.stderr,
+        )
+    server.shutdown()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if regressions := check_regressions(results, baseline, args.max_regression):
+            print("Regressions found:\n" + "\n".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import json
+import random
+import re
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from pathlib import Path
+from threading import Lock, Thread
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+
+import xmltodict
+
+fixtures_dir = Path(__file__).parent / "fixtures"
+
+# Hosts served by the stub, see 'StubHandler.routes'
+stubbed_hosts = (
+    "quote.cnbc.com",
+    "tvc6.investing.com",
+    "query1.finance.yahoo.com",
+    "www.investing.com",
+    "www.onvista.de",
+    "www.wetter.com",
+)
+
+
+def load_fixture(name: str) -> str:
+    return (fixtures_dir / name).read_text()
+
+
+def pad_html(html: str, size: int) -> str:
+    """Pad html with unrelated markup up to size bytes, real pages are a lot larger than the fixtures"""
+    filler = '<div class="filler"><p>Lorem ipsum dolor sit amet</p><a href="#">consectetur</a></div>\n'
+    missing = max(0, size - len(html.encode()))
+    return html.replace(
+        "<body>", "<body>\n" + filler * (missing // len(filler.encode())), 1
+    )
+
+
+def page_handler(name: str):
+    """Create a route handler answering with the padded HTML page fixture name"""
+
+    def handler(self, query: dict) -> tuple:
+        return 200, "text/html", self.server.pages[name]
+
+    return handler
+
+
+class StubServer(ThreadingHTTPServer):
+    """Local HTTP server answering requests for all data providers and the weather provider
+
+    Requests are expected in the form of 'lib.web.redirect_url', i.e. with the original host as first segment
+    of the path.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        cnbc_format: str = "json",
+        page_size: int = 300 * 1024,
+    ):
+        """
+        @param address: Address to listen on, port 0 picks a free port
+        @param latency: Seconds to wait before answering each request
+        @param error_rate: Fraction of requests to answer with HTTP 503
+        @param cnbc_format: Format of CNBC answers, either 'json', 'xml' or 'mixed'
+        @param page_size: Size in bytes the scraped HTML pages are padded to
+        """
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.cnbc_format = cnbc_format
+        self.pages = {
+            name: pad_html(load_fixture(name), page_size)
+            for name in ("investing_com.html", "onvista.html", "wetter_com.html")
+        }
+        self.cnbc_quotes = json.loads(load_fixture("cnbc_quotes.json"))[
+            "FormattedQuoteResult"
+        ]["FormattedQuote"]
+        self.investiny_quotes = json.loads(load_fixture("investiny_quotes.json"))
+        self.yahoo_spark = json.loads(load_fixture("yahoo_spark.json"))
+        self.request_counts = Counter()
+        self.response_bytes = Counter()
+        self._counter_lock = Lock()
+        self._cnbc_answers = count()
+        self._random = random.Random(1337)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    @property
+    def redirected_hosts(self) -> dict:
+        """Mapping to use for 'lib.web.redirected_hosts'"""
+        return {host: self.base_url for host in stubbed_hosts}
+
+    def start(self) -> "StubServer":
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset_counters(self) -> None:
+        with self._counter_lock:
+            self.request_counts.clear()
+            self.response_bytes.clear()
+
+    def record(self, host: str, size: int) -> None:
+        with self._counter_lock:
+            self.request_counts[host] += 1
+            self.response_bytes[host] += size
+
+    def inject_error(self) -> bool:
+        with self._counter_lock:
+            return self._random.random() < self.error_rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        _, host, path = self.path.split("/", 2)
+        parts = urlsplit(f"/{path}")
+        query = parse_qs(parts.query)
+        if self.server.latency:
+            sleep(self.server.latency)
+
+        if self.server.inject_error():
+            self.respond(host, 503, "text/plain", "Service Unavailable")
+            return
+
+        for route_host, path_regex, handler in self.routes:
+            if host == route_host and re.search(path_regex, parts.path):
+                status, content_type, body = handler(self, query)
+                self.respond(host, status, content_type, body)
+                return
+        self.respond(host, 404, "text/plain", "Not Found")
+
+    def respond(self, host: str, status: int, content_type: str, body: str) -> None:
+        encoded = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+        self.server.record(host, len(encoded))
+
+    @staticmethod
+    def requested_symbols(query: dict, separator: str) -> list:
+        return query.get("symbols", [""])[0].split(separator)
+
+    def cnbc_quotes(self, query: dict) -> tuple:
+        symbols = self.requested_symbols(query, "|")
+        quotes = [q for q in self.server.cnbc_quotes if q["symbol"] in symbols]
+        result = {"FormattedQuoteResult": {"FormattedQuote": quotes}}
+        # The mixed format alternates between JSON and XML like the real API occasionally does
+        as_xml = self.server.cnbc_format == "xml" or (
+            self.server.cnbc_format == "mixed" and next(self.server._cnbc_answers) % 2
+        )
+        if as_xml:
+            return 200, "application/xml", xmltodict.unparse(result)
+        return 200, "application/json", json.dumps(result)
+
+    def investiny_quotes(self, query: dict) -> tuple:
+        symbols = self.requested_symbols(query, ",")
+        result = dict(self.server.investiny_quotes)
+        result["d"] = [q for q in result["d"] if q["n"] in symbols]
+        return 200, "application/json", json.dumps(result)
+
+    def yahoo_spark(self, query: dict) -> tuple:
+        symbols = self.requested_symbols(query, ",")
+        results = [
+            r
+            for r in self.server.yahoo_spark["spark"]["result"]
+            if r["symbol"] in symbols
+        ]
+        return (
+            200,
+            "application/json",
+            json.dumps({"spark": {"result": results, "error": None}}),
+        )
+
+    routes = (
+        ("quote.cnbc.com", r"/restQuote/", cnbc_quotes),
+        ("tvc6.investing.com", r"/quotes$", investiny_quotes),
+        ("query1.finance.yahoo.com", r"/v7/finance/spark$", yahoo_spark),
+        ("www.investing.com", r"^/", page_handler("investing_com.html")),
+        ("www.onvista.de", r"^/", page_handler("onvista.html")),
+        ("www.wetter.com", r"^/", page_handler("wetter_com.html")),
+    )
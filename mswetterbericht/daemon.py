@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import socket
+from argparse import Namespace
+from http.client import HTTPConnection, HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from urllib.parse import urlsplit
+
+import attr
+
+from mswetterbericht.lib.history import HistoryStore
+from mswetterbericht.lib.metrics import recorder
+from mswetterbericht.wetterbericht import (
+    configure_cache,
+    configure_last_known_good,
+    configure_scraper,
+    default_listen_address,
+    default_refresh_interval,
+    load_config,
+    render_forecast,
+    write_metrics,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks of the configuration files for changes
+config_check_interval = 5
+
+# Seconds a request waits for the very first forecast after the daemon started
+first_forecast_timeout = 120
+
+# Seconds until the next refresh if the forecast had to show last known good quotes
+stale_refresh_interval = 60
+
+
+@attr.define(kw_only=True)
+class ForecastDaemon:
+    """Keeps the configuration and the latest forecast in memory and refreshes it in the background
+
+    Scraper sessions and the response cache live as long as the process, so refreshes are warm.
+    The configuration files are reloaded as soon as they change. Forecasts showing last known good quotes are
+    refreshed after 'stale_refresh_interval' already.
+    """
+
+    instruments_file: str
+    prose_file: str
+    refresh_interval: float = default_refresh_interval
+    deadline: float | None = None
+    weather_budget: float | None = None
+    # Store for the quotes of every refresh, the source of 'wetterbericht.py weekly'
+    history: HistoryStore | None = None
+    # Arguments of 'wetterbericht.add_metrics_arguments', metrics are written after every refresh
+    metrics_args: Namespace | None = None
+
+    forecast: str | None = attr.field(default=None, init=False)
+    # Unix timestamp of the latest forecast
+    rendered_at: float | None = attr.field(default=None, init=False)
+    _config: tuple | None = attr.field(default=None, init=False)
+    _config_mtimes: tuple | None = attr.field(default=None, init=False)
+    _lock: Lock = attr.field(factory=Lock, init=False)
+    _first_forecast: Event = attr.field(factory=Event, init=False)
+    _stopped: Event = attr.field(factory=Event, init=False)
+    _refresh_requested: Event = attr.field(factory=Event, init=False)
+
+    def start(self) -> "ForecastDaemon":
+        # Fail right away on an invalid configuration, later changes are only logged
+        self.load_config()
+        Thread(target=self.run, name="refresh", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._refresh_requested.set()
+
+    def request_refresh(self) -> None:
+        self._refresh_requested.set()
+
+    def run(self) -> None:
+        """Refresh the forecast every 'refresh_interval' seconds and right after the configuration changed"""
+        next_refresh = monotonic()
+        while not self._stopped.is_set():
+            if self.reload_config():
+                next_refresh = monotonic()
+            if self._refresh_requested.is_set():
+                self._refresh_requested.clear()
+                next_refresh = monotonic()
+            if monotonic() >= next_refresh and self._config is not None:
+                next_refresh = monotonic() + self.refresh_delay(self.refresh())
+            self._refresh_requested.wait(
+                min(config_check_interval, max(0.0, next_refresh - monotonic()))
+            )
+
+    def refresh_delay(self, stale: bool) -> float:
+        """Seconds until the next refresh, shorter if the latest forecast had to show last known good quotes"""
+        if stale:
+            return min(stale_refresh_interval, self.refresh_interval)
+        return self.refresh_interval
+
+    def reload_config(self) -> bool:
+        """Load the configuration files if they changed since they were loaded last, errors only get logged
+
+        @return: Whether the configuration was (re)loaded
+        """
+        try:
+            if self.config_mtimes() == self._config_mtimes:
+                return False
+            self.load_config()
+        except Exception as e:
+            logger.error(
+                f"Could not load the configuration, keeping the previous one. Error args: {e.args}"
+            )
+            return False
+        return True
+
+    def config_mtimes(self) -> tuple:
+        return (
+            os.stat(self.instruments_file).st_mtime_ns,
+            os.stat(self.prose_file).st_mtime_ns,
+        )
+
+    def load_config(self) -> None:
+        """Load the configuration files, raises 'lib.config.ConfigError' for invalid files"""
+        mtimes = self.config_mtimes()
+        self._config = load_config(self.instruments_file, self.prose_file)
+        self._config_mtimes = mtimes
+        logger.info("Loaded the configuration.")
+
+    def refresh(self) -> bool:
+        """Create a new forecast, the previous one is kept if that fails
+
+        @return: Whether the new forecast shows last known good quotes instead of current ones
+        """
+        # Only keep the metrics of the latest refresh, they'd pile up otherwise
+        recorder.reset()
+        goethe, instruments_file_content = self._config
+        try:
+            forecast = render_forecast(
+                goethe,
+                instruments_file_content,
+                self.deadline,
+                self.weather_budget,
+                self.history,
+            )
+        except Exception as e:
+            logger.error(
+                f"Could not refresh the forecast, keeping the previous one. Error args: {e.args}"
+            )
+            recorder.increment("daemon_refresh_errors_total")
+        else:
+            with self._lock:
+                self.forecast = forecast
+                self.rendered_at = time()
+            self._first_forecast.set()
+            logger.info("Refreshed the forecast.")
+        stale = recorder.total("instrument_stale_total") > 0
+        if self.metrics_args is not None:
+            write_metrics(self.metrics_args)
+        return stale
+
+    def latest(self, timeout: float | None = None) -> tuple:
+        """Get the latest forecast, waiting for the first one if there's none yet
+
+        @param timeout: Seconds to wait for the first forecast
+        @return: Tuple of the forecast (None if there's none yet) and its Unix timestamp
+        """
+        self._first_forecast.wait(timeout)
+        with self._lock:
+            return self.forecast, self.rendered_at
+
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    """Serves the forecast of the 'ForecastDaemon' of the server
+
+    GET /forecast returns the latest forecast as Markdown, GET /status its age as JSON and POST /refresh triggers
+    a refresh in the background.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"Request: {format % args}")
+
+    def do_GET(self):
+        daemon = self.server.forecast_daemon
+        if self.path == "/forecast":
+            forecast, rendered_at = daemon.latest(timeout=first_forecast_timeout)
+            if forecast is None:
+                self.respond(503, "text/plain", "No forecast yet.")
+                return
+            self.respond(
+                200,
+                "text/markdown",
+                forecast,
+                {"X-Forecast-Age": f"{time() - rendered_at:.0f}"},
+            )
+        elif self.path == "/status":
+            _, rendered_at = daemon.latest(timeout=0)
+            status = {
+                "rendered_at": rendered_at,
+                "age": None if rendered_at is None else time() - rendered_at,
+            }
+            self.respond(200, "application/json", json.dumps(status))
+        else:
+            self.respond(404, "text/plain", "Not Found")
+
+    def do_POST(self):
+        if self.path == "/refresh":
+            self.server.forecast_daemon.request_refresh()
+            self.respond(202, "text/plain", "Refresh requested.")
+        else:
+            self.respond(404, "text/plain", "Not Found")
+
+    def respond(
+        self, status: int, content_type: str, body: str, headers: dict | None = None
+    ) -> None:
+        encoded = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """ThreadingHTTPServer listening on a Unix socket"""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        # Remove the socket of a previous run
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+class UnixHTTPHandler(ForecastHandler):
+    # The client address of Unix sockets is an empty string, which the default logging can't handle
+    def address_string(self):
+        return "unix"
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTPConnection to a server listening on a Unix socket"""
+
+    def __init__(self, path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def create_server(
+    forecast_daemon: ForecastDaemon,
+    listen: str | None = None,
+    socket_path: str | None = None,
+):
+    """Create the HTTP server for forecast_daemon, either listening on a TCP address or a Unix socket
+
+    @param forecast_daemon: The daemon to serve the forecasts of
+    @param listen: Address in the form 'host:port', ignored if socket_path is given
+    @param socket_path: Path of the Unix socket to listen on
+    @return: The server, ready for 'serve_forever'
+    """
+    if socket_path:
+        server = UnixHTTPServer(socket_path, UnixHTTPHandler)
+    else:
+        host, port = (listen or default_listen_address).rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), ForecastHandler)
+        server.daemon_threads = True
+    server.forecast_daemon = forecast_daemon
+    return server
+
+
+def create_daemon(args: Namespace) -> ForecastDaemon:
+    """Configure the forecasts and create the daemon with the arguments of 'wetterbericht.parse_args'
+
+    'wetterbericht.py serve' runs the script as '__main__', a different module than the
+    'mswetterbericht.wetterbericht' used here. So the caches and the last known good quotes are configured here,
+    for the module which actually renders the forecasts.
+    """
+    configure_cache(args)
+    configure_scraper(args)
+    configure_last_known_good(args)
+    return ForecastDaemon(
+        instruments_file=args.instruments_file,
+        prose_file=args.prose_file,
+        refresh_interval=args.refresh_interval,
+        deadline=args.deadline,
+        weather_budget=args.weather_budget,
+        history=None if args.no_history else HistoryStore(directory=args.history_dir),
+        metrics_args=args,
+    )
+
+
+def serve(args: Namespace) -> None:
+    """Run the daemon with the arguments of 'wetterbericht.parse_args' until interrupted"""
+    forecast_daemon = create_daemon(args).start()
+    server = create_server(forecast_daemon, args.listen, args.socket)
+    logger.info(f"Serving forecasts on {args.socket or args.listen}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        forecast_daemon.stop()
+        server.server_close()
+
+
+def request_forecast(
+    daemon_url: str, timeout: float = 10, max_age: float | None = None
+) -> str:
+    """Get the latest forecast from a running daemon
+
+    @param daemon_url: URL of the daemon, either 'http://host:port' or 'unix:///path/to/socket'
+    @param timeout: Seconds to wait for the daemon
+    @param max_age: Oldest forecast in seconds accepted, e.g. because the daemon can't refresh it anymore
+    @return: The forecast as Markdown
+    """
+    url = urlsplit(daemon_url)
+    if url.scheme == "unix":
+        connection = UnixHTTPConnection(url.path, timeout=timeout)
+    else:
+        connection = HTTPConnection(url.netloc, timeout=timeout)
+    try:
+        connection.request("GET", "/forecast")
+        r = connection.getresponse()
+        body = r.read().decode()
+    finally:
+        connection.close()
+    if r.status != 200:
+        raise HTTPException(f"Daemon answered with HTTP {r.status}: {body}")
+    if max_age is not None:
+        age = r.getheader("X-Forecast-Age")
+        if age is None or float(age) > max_age:
+            raise HTTPException(
+                f"Forecast of the daemon is {age}s old, accepting {max_age}s at most."
+            )
+    return body
@@ -1,14 +1,22 @@
 import json.decoder
 import logging
 import re
+from threading import Lock
+
 import xmltodict
 import attr
 
-from mswetterbericht.lib.web import resilient_request
+from mswetterbericht.lib.web import async_resilient_request, resilient_request
 from mswetterbericht.wetterbericht import Instrument
 
 logger = logging.getLogger(__name__)
 
+# The quote API is rather forgiving regarding concurrent requests
+max_concurrency = 4
+
+# Seconds a cached quote may be reused, mostly relevant for reruns
+cache_ttl = 300
+
 api_base_path = (
     "https://quote.cnbc.com/quote-html-webservice/restQuote/symbolType/symbol?symbols="
 )
@@ -19,6 +27,13 @@ additional_headers = {"Accept": "application/json", "Content-Type": "application
 # The Regex to filter an instrument price so pre- or suffixes are removed
 number_regex = re.compile(r"\d{1,3}(,\d{3})*(\.\d+)?")
 
+# The API takes several symbols at once when separated by a pipe
+symbol_separator = "|"
+
+# Quotes fetched by 'prefetch', consumed by 'get_price_and_change'
+prefetched_quotes = {}
+prefetched_quotes_lock = Lock()
+
 
 @attr.define(kw_only=True)
 class ProviderInstrument(Instrument):
@@ -30,21 +45,60 @@ class ProviderInstrument(Instrument):
     def from_instrument_data(cls, instrument_data):
         """Create a ProviderInstrument by scraping Investing.com"""
         current_value, pct_change = get_price_and_change(instrument_data["symbol"])
-        instrument_values = super().create_values(
+        instrument_values = cls.create_values(
             pct_change=pct_change, absolute_value=current_value
         )
         return cls(**instrument_data, values=instrument_values)
 
 
-def get_price_and_change(instrument_symbol) -> list:
-    # As the API occasionally responds with XML (even with the additional headers), convert the answer if it's not JSON
+async def prefetch(instruments: list) -> None:
+    """Fetch the quotes of all instruments in a single batched request
+
+    Also used by other data providers relying on CNBC, so all their instruments share one request.
+    """
+    # Quotes not consumed by an earlier run (e.g. cut off by the deadline) mustn't be served as current ones
+    with prefetched_quotes_lock:
+        prefetched_quotes.clear()
+    symbols = list(dict.fromkeys(instrument["symbol"] for instrument in instruments))
+    r = await async_resilient_request(
+        api_base_path + symbol_separator.join(symbols),
+        additional_headers=additional_headers,
+        cache_ttl=cache_ttl,
+    )
+    quotes = {quote["symbol"]: quote for quote in parse_quotes(r)}
+    with prefetched_quotes_lock:
+        prefetched_quotes.update(quotes)
+    logger.debug(f"Prefetched {len(quotes)} of {len(symbols)} CNBC quotes.")
+
+
+def request_quotes(instrument_symbols: list) -> list:
+    """Request the FormattedQuotes for all instrument_symbols at once"""
     r = resilient_request(
-        api_base_path + instrument_symbol, additional_headers=additional_headers
+        api_base_path + symbol_separator.join(instrument_symbols),
+        additional_headers=additional_headers,
+        cache_ttl=cache_ttl,
     )
+    return parse_quotes(r)
+
+
+def parse_quotes(r) -> list:
+    """Extract the FormattedQuotes from a response of the quote API"""
+    # As the API occasionally responds with XML (even with the additional headers), convert the answer if it's not JSON
     try:
-        r_json = r.json()["FormattedQuoteResult"]["FormattedQuote"][0]
+        quotes = r.json()["FormattedQuoteResult"]["FormattedQuote"]
     except json.decoder.JSONDecodeError:
-        r_json = xmltodict.parse(r.text)["FormattedQuoteResult"]["FormattedQuote"]
+        quotes = xmltodict.parse(r.text)["FormattedQuoteResult"]["FormattedQuote"]
+    # xmltodict only creates a list for repeated elements
+    if isinstance(quotes, dict):
+        quotes = [quotes]
+    return quotes
+
+
+def get_price_and_change(instrument_symbol) -> list:
+    with prefetched_quotes_lock:
+        r_json = prefetched_quotes.pop(instrument_symbol, None)
+    if r_json is None:
+        r_json = request_quotes([instrument_symbol])[0]
     # Filter pre- and suffixes and remove thousands separator so the value can be converted to float
     current_value = float(number_regex.search(r_json["last"]).group().replace(",", ""))
     old_value = float(
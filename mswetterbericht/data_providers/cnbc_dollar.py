@@ -3,6 +3,8 @@ import attr
 
 from mswetterbericht.data_providers.cnbc import (
     ProviderInstrument as CNBCProviderInstrument,
+    max_concurrency,
+    prefetch,
 )
 from mswetterbericht.wetterbericht import InstrumentValues
 
@@ -22,11 +24,6 @@ class DollarValues(InstrumentValues):
 class ProviderInstrument(CNBCProviderInstrument):
     """CNBC ProviderInstrument with absolute_value in $$$"""
 
-    @classmethod
-    def from_instrument_data(cls, instrument_data: dict):
-        myclass = super().from_instrument_data(instrument_data)
-        myclass.values = DollarValues(
-            pct_change=myclass.values.pct_change,
-            absolute_value=myclass.values.absolute_value,
-        )
-        return myclass
+    @staticmethod
+    def create_values(pct_change: float, absolute_value: float) -> DollarValues:
+        return DollarValues(pct_change=pct_change, absolute_value=absolute_value)
@@ -1,13 +1,19 @@
 import logging
 
 import attr
-from bs4 import BeautifulSoup
 
+from mswetterbericht.lib.parsing import parse_html
 from mswetterbericht.lib.web import resilient_request
 from mswetterbericht.wetterbericht import Instrument
 
 logger = logging.getLogger(__name__)
 
+# Investing.com is quick to serve Cloudflare challenges, don't hammer it
+max_concurrency = 2
+
+# Seconds a cached page may be reused, mostly relevant for reruns
+cache_ttl = 300
+
 
 @attr.define(kw_only=True)
 class ProviderInstrument(Instrument):
@@ -17,15 +23,24 @@ class ProviderInstrument(Instrument):
     def from_instrument_data(cls, instrument_data):
         """Create a ProviderInstrument by scraping Investing.com"""
         current_price, pct_change = get_price_and_change(instrument_data["url"])
-        instrument_values = super().create_values(
+        instrument_values = cls.create_values(
             pct_change=pct_change, absolute_value=current_price
         )
         return cls(**instrument_data, values=instrument_values)
 
 
 def get_price_and_change(url) -> list:
-    r = resilient_request(url)
-    soup = BeautifulSoup(r.text, "html.parser")
+    r = resilient_request(url, cache_ttl=cache_ttl)
+    soup = parse_html(
+        r.text,
+        "span",
+        {
+            "data-test": [
+                "instrument-price-change-percent",
+                "instrument-price-last",
+            ]
+        },
+    )
     pct_span = soup.find("span", {"data-test": "instrument-price-change-percent"})
     # Differentiate between negative and positive values due to differing formatting
     if pct_span.contents[2] == "+":
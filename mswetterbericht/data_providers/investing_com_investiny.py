@@ -1,18 +1,34 @@
 from datetime import datetime, timezone
+from threading import Lock
 from typing import Any, Dict, List, Literal, Union
+from importlib import import_module
+from urllib.parse import urlencode
 from uuid import uuid4
-import cloudscraper
 
-from investiny.config import Config
-
-import sys
 import attr
 import logging
 
+from mswetterbericht.lib.web import resilient_request
 from mswetterbericht.wetterbericht import Instrument
 
 logger = logging.getLogger(__name__)
 
+# Investing.com is quick to serve Cloudflare challenges, don't hammer it
+max_concurrency = 2
+
+# The 'investiny.info' module, set by 'init' after monkey patching it
+investiny_info_module = None
+
+# The API expects a random ID in the path, one per process like the session of a single browser
+api_session_id = uuid4().hex
+
+# The API takes several symbols at once when separated by a comma
+symbol_separator = ","
+
+# Quotes fetched by 'prefetch', consumed by 'ProviderInstrument.from_instrument_data'
+prefetched_quotes = {}
+prefetched_quotes_lock = Lock()
+
 
 # Monkey patch method to use cloudscraper instead of httpx
 def request_to_investing_cloudscraper(
@@ -20,6 +36,8 @@ def request_to_investing_cloudscraper(
 ) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
     """Sends an HTTP GET request to Investing.com API with the introduced params.
 
+    The shared Android-profile scraper session is used with the timeouts and retries of 'resilient_request'.
+
     Args:
         endpoint: Endpoint to send the request to.
         params: A dictionary with the params to send to Investing.com API.
@@ -27,24 +45,17 @@ def request_to_investing_cloudscraper(
     Returns:
         A dictionary with the response from Investing.com API.
     """
-    url = f"https://tvc6.investing.com/{uuid4().hex}/0/0/0/0/{endpoint}"
+    url = f"https://tvc6.investing.com/{api_session_id}/0/0/0/0/{endpoint}?{urlencode(params, safe=':,')}"
     headers = {
         "Referer": "https://tvc-invdn-com.investing.com/",
         "Content-Type": "application/json",
     }
-    # Taken from https://github.com/alvarobartt/investiny/issues/71
-    scraper = cloudscraper.create_scraper(
-        browser={"browser": "chrome", "platform": "android", "desktop": False}
-    )
-    # TODO: Maybe use mswetterbericht.lib.web.resilient_request
-    r = scraper.get(url, params=params, headers=headers)
-    if r.status_code != 200:
-        raise ConnectionError(
-            f"Request to Investing.com API failed with error code: {r.status_code}."
-        )
+    r = resilient_request(url, additional_headers=headers, profile="android")
     d = r.json()
 
     if endpoint in ["history", "quotes"] and d["s"] != "ok":
+        from investiny.config import Config
+
         raise ConnectionError(
             f"Request to Investing.com API failed with error message: {d['s']}."
             if "nextTime" not in d
@@ -57,13 +68,36 @@ def request_to_investing_cloudscraper(
     return d  # type: ignore
 
 
-# As investiny has a function 'investiny.info' as well, we need to monkey patch this way
-# Source: https://stackoverflow.com/a/22375385
-investiny_info_module = sys.modules["investiny.info"]
-setattr(
-    investiny_info_module, "request_to_investing", request_to_investing_cloudscraper
-)
-logger.debug("Monkey patched investiny.info.request_to_investing.")
+def prefetch(instruments: list) -> None:
+    """Fetch the quotes of all instruments in a single request
+
+    Also used by 'investing_com_investiny_upsidedown', so the instruments of both data providers share one request.
+    """
+    # Quotes not consumed by an earlier run (e.g. cut off by the deadline) mustn't be served as current ones
+    with prefetched_quotes_lock:
+        prefetched_quotes.clear()
+    symbols = list(dict.fromkeys(instrument["symbol"] for instrument in instruments))
+    d = request_to_investing_cloudscraper(
+        "quotes", {"symbols": symbol_separator.join(symbols)}
+    )
+    # Unknown symbols are answered with an error status per entry
+    quotes = {entry["n"]: entry["v"] for entry in d["d"] if entry.get("s") == "ok"}
+    with prefetched_quotes_lock:
+        prefetched_quotes.update(quotes)
+    logger.debug(f"Prefetched {len(quotes)} of {len(symbols)} Investing.com quotes.")
+
+
+def init() -> None:
+    """Import investiny and monkey patch it, called before the first instrument is created"""
+    global investiny_info_module
+    if investiny_info_module is not None:
+        return
+    # As investiny has a function 'investiny.info' as well, we need to monkey patch this way
+    # Source: https://stackoverflow.com/a/22375385
+    module = import_module("investiny.info")
+    setattr(module, "request_to_investing", request_to_investing_cloudscraper)
+    investiny_info_module = module
+    logger.debug("Monkey patched investiny.info.request_to_investing.")
 
 
 @attr.define(kw_only=True)
@@ -75,10 +109,13 @@ class ProviderInstrument(Instrument):
     @classmethod
     def from_instrument_data(cls, instrument_data):
         """Create a ProviderInstrument by scraping Investing.com"""
-        investiny_request = investiny_info_module.info(instrument_data["symbol"])[
-            instrument_data["symbol"]
-        ]
-        instrument_values = super().create_values(
+        with prefetched_quotes_lock:
+            investiny_request = prefetched_quotes.pop(instrument_data["symbol"], None)
+        if investiny_request is None:
+            investiny_request = investiny_info_module.info(instrument_data["symbol"])[
+                instrument_data["symbol"]
+            ]
+        instrument_values = cls.create_values(
             pct_change=investiny_request["chp"], absolute_value=investiny_request["lp"]
         )
         return cls(**instrument_data, values=instrument_values)
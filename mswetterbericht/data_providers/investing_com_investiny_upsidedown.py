@@ -3,7 +3,11 @@ import upsidedown
 
 from mswetterbericht.data_providers.investing_com_investiny import (
     ProviderInstrument as InvestingDotComProviderInstrument,
+    init,
+    max_concurrency,
+    prefetch,
 )
+from mswetterbericht.lib.templates import RenderPlan, compile_template
 from mswetterbericht.wetterbericht import InstrumentLine
 
 
@@ -12,22 +16,16 @@ class UpsideDownLine(InstrumentLine):
     # Takes a list of strings, every second one will be transformed upside down
     line: list
 
-    def generate_line(self, change_word: str, **kwargs) -> str:
-        """
-        @param change_word: Prose word for the change
-        @param kwargs: Remaining required argument for creating a line, depending on instrument type
-        @return: A properly filled and formatted instrument line
-        """
-        new_line = self.line.copy()
-        for i, item in enumerate(new_line):
-            new_item = item.format(verb=self.verb, change_word=change_word, **kwargs)
+    def compile_line(self) -> RenderPlan:
+        """Compile all items into one RenderPlan, static parts of the upside-down items are transformed only once"""
+        plan = RenderPlan(())
+        for i, item in enumerate(self.line):
             # Transform every second item
             if i % 2 == 1:
-                new_line[i] = upsidedown.transform(new_item)
+                plan += compile_template(item, upsidedown.transform, reverse=True)
             else:
-                new_line[i] = new_item
-
-        return "".join(new_line)
+                plan += compile_template(item)
+        return plan
 
 
 @attr.define(kw_only=True)
@@ -1,14 +1,26 @@
 import logging
 
 import attr
-from bs4 import BeautifulSoup
 
+from mswetterbericht.lib.parsing import parse_html
 from mswetterbericht.lib.web import resilient_request
 from mswetterbericht.wetterbericht import Instrument
 from mswetterbericht.wetterbericht import InstrumentValues
 
 logger = logging.getLogger(__name__)
 
+# Only used for a single instrument anyway
+max_concurrency = 1
+
+# Seconds a cached page may be reused, mostly relevant for reruns
+cache_ttl = 300
+
+# Attributes of the div containing price and change
+price_div_attrs = {
+    "class": "flex-layout flex-layout__align-items--baseline ov-flex-layout--column-sm "
+    "text-size--xlarge"
+}
+
 
 @attr.define(kw_only=True)
 class EuroValues(InstrumentValues):
@@ -22,26 +34,24 @@ class EuroValues(InstrumentValues):
 class ProviderInstrument(Instrument):
     """Onvista ProviderInstrument"""
 
+    @staticmethod
+    def create_values(pct_change: float, absolute_value: float) -> EuroValues:
+        return EuroValues(pct_change=pct_change, absolute_value=absolute_value)
+
     @classmethod
     def from_instrument_data(cls, instrument_data):
         """Create a ProviderInstrument by scraping Onvista"""
         current_price, pct_change = get_price_and_change(instrument_data["url"])
-        instrument_values = EuroValues(
+        instrument_values = cls.create_values(
             pct_change=pct_change, absolute_value=current_price
         )
         return cls(**instrument_data, values=instrument_values)
 
 
 def get_price_and_change(url) -> list:
-    r = resilient_request(url)
-    soup = BeautifulSoup(r.text, "html.parser")
-    mydiv = soup.find(
-        "div",
-        {
-            "class": "flex-layout flex-layout__align-items--baseline ov-flex-layout--column-sm "
-            "text-size--xlarge"
-        },
-    )
+    r = resilient_request(url, cache_ttl=cache_ttl)
+    soup = parse_html(r.text, "div", price_div_attrs)
+    mydiv = soup.find("div", price_div_attrs)
     raw_price = mydiv.find(
         "data", {"class": "text-nowrap text-weight--medium outer-spacing--xsmall-right"}
     ).contents[0]
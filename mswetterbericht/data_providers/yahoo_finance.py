@@ -1,8 +1,33 @@
+import logging
+from threading import Lock
+from urllib.parse import quote
+
 import attr
-import yfinance as yf
 
+from mswetterbericht.lib.web import RequestError, acquire_rate_limit, resilient_request
 from mswetterbericht.wetterbericht import Instrument
 
+logger = logging.getLogger(__name__)
+
+max_concurrency = 4
+
+# Seconds a cached quote may be reused, mostly relevant for reruns
+cache_ttl = 300
+
+# The spark API only returns the chart metadata which already contains both required prices
+spark_base_path = (
+    "https://query1.finance.yahoo.com/v7/finance/spark?range=1d&interval=1d&symbols="
+)
+# The spark API refuses requests with more symbols
+max_symbols_per_request = 20
+
+# yfinance requests this host with its own session, so it has to be rate limited explicitly
+yfinance_url = "https://query2.finance.yahoo.com/"
+
+# Prices fetched by 'prefetch', consumed by 'get_price_and_previous_close'
+prefetched_prices = {}
+prefetched_prices_lock = Lock()
+
 
 @attr.define(kw_only=True)
 class ProviderInstrument(Instrument):
@@ -13,13 +38,70 @@ class ProviderInstrument(Instrument):
     @classmethod
     def from_instrument_data(cls, instrument_data: dict):
         """Create a ProviderInstrument by querying Yahoo Finance and calculating required values"""
-        ticker = yf.Ticker(instrument_data["symbol"])
-        current_price = ticker.info["regularMarketPrice"]
-        old_price = ticker.info["regularMarketPreviousClose"]
+        current_price, old_price = get_price_and_previous_close(
+            instrument_data["symbol"]
+        )
         pct_change = round((((current_price - old_price) / old_price) * 100), 2)
 
-        instrument_values = super().create_values(
+        instrument_values = cls.create_values(
             pct_change=pct_change, absolute_value=current_price
         )
 
         return cls(**instrument_data, values=instrument_values)
+
+
+def prefetch(instruments: list) -> None:
+    """Fetch the prices of all instruments with as few requests as possible
+
+    Also used by other data providers relying on Yahoo Finance, so all their instruments share the requests.
+    """
+    # Prices not consumed by an earlier run (e.g. cut off by the deadline) mustn't be served as current ones
+    with prefetched_prices_lock:
+        prefetched_prices.clear()
+    symbols = list(dict.fromkeys(instrument["symbol"] for instrument in instruments))
+    prices = {}
+    for i in range(0, len(symbols), max_symbols_per_request):
+        prices.update(request_prices(symbols[i : i + max_symbols_per_request]))
+    with prefetched_prices_lock:
+        prefetched_prices.update(prices)
+    logger.debug(f"Prefetched {len(prices)} of {len(symbols)} Yahoo Finance prices.")
+
+
+def request_prices(symbols: list) -> dict:
+    """Request the current price and previous close for all symbols at once
+
+    @param symbols: Yahoo Finance symbols
+    @return: Dict with the symbols as keys and a list of current price and previous close as values
+    """
+    r = resilient_request(
+        spark_base_path + ",".join(quote(symbol) for symbol in symbols),
+        cache_ttl=cache_ttl,
+    )
+    prices = {}
+    for result in r.json()["spark"]["result"]:
+        meta = result["response"][0]["meta"]
+        prices[result["symbol"]] = [
+            meta["regularMarketPrice"],
+            meta.get("previousClose") or meta["chartPreviousClose"],
+        ]
+    return prices
+
+
+def get_price_and_previous_close(symbol: str) -> list:
+    with prefetched_prices_lock:
+        prices = prefetched_prices.pop(symbol, None)
+    if prices is not None:
+        return prices
+
+    try:
+        return request_prices([symbol])[symbol]
+    except (KeyError, IndexError, ValueError, RequestError) as e:
+        logger.warning(
+            f"Could not get {symbol} from the spark API, falling back to yfinance. Error args: {e.args}"
+        )
+    # Heavy import, only required for the fallback
+    import yfinance as yf
+
+    acquire_rate_limit(yfinance_url)
+    info = yf.Ticker(symbol).info
+    return [info["regularMarketPrice"], info["regularMarketPreviousClose"]]
@@ -2,6 +2,8 @@ import attr
 
 from mswetterbericht.data_providers.yahoo_finance import (
     ProviderInstrument as YFProviderInstrument,
+    max_concurrency,
+    prefetch,
 )
 from mswetterbericht.wetterbericht import InstrumentValues
 
@@ -18,11 +20,6 @@ class DollarValues(InstrumentValues):
 class ProviderInstrument(YFProviderInstrument):
     """Yahoo Finance ProviderInstrument with absolute_value in $$$"""
 
-    @classmethod
-    def from_instrument_data(cls, instrument_data: dict):
-        myclass = super().from_instrument_data(instrument_data)
-        myclass.values = DollarValues(
-            pct_change=myclass.values.pct_change,
-            absolute_value=myclass.values.absolute_value,
-        )
-        return myclass
+    @staticmethod
+    def create_values(pct_change: float, absolute_value: float) -> DollarValues:
+        return DollarValues(pct_change=pct_change, absolute_value=absolute_value)
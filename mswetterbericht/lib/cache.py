@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from time import time
+
+import attr
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+default_cache_dir = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "mswetterbericht"
+)
+# 50 MiB should be plenty for a few dozen pages
+default_max_size = 50 * 1024 * 1024
+
+# Response headers which are stored alongside the body
+stored_headers = ("Content-Type", "ETag", "Last-Modified")
+
+
+@attr.define(kw_only=True)
+class CacheEntry:
+    url: str
+    stored_at: float
+    encoding: str | None
+    headers: dict
+    body: bytes
+
+    @property
+    def age(self) -> float:
+        return time() - self.stored_at
+
+    @property
+    def validators(self) -> dict:
+        """Headers for a conditional request revalidating this entry"""
+        validators = {}
+        if etag := self.headers.get("ETag"):
+            validators["If-None-Match"] = etag
+        if last_modified := self.headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = last_modified
+        return validators
+
+    def to_response(self) -> Response:
+        """Recreate a requests Response from the cached entry"""
+        r = Response()
+        r.status_code = 200
+        r.url = self.url
+        r.encoding = self.encoding
+        r.headers = CaseInsensitiveDict(self.headers)
+        r._content = self.body
+        return r
+
+
+@attr.define(kw_only=True)
+class ResponseCache:
+    """Persistent cache for response bodies and their validators, evicting the least recently used entries
+
+    Every entry consists of a body and a JSON metadata file named after the hash of the URL. The modification
+    time of the metadata file is used as last access time for the LRU eviction.
+    """
+
+    directory: Path = attr.field(converter=Path)
+    max_size: int = default_max_size
+    _lock: Lock = attr.field(factory=Lock, init=False)
+
+    def __attrs_post_init__(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple:
+        key = sha256(url.encode()).hexdigest()
+        return self.directory / f"{key}.json", self.directory / f"{key}.body"
+
+    def get(self, url: str) -> CacheEntry | None:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            body = body_path.read_bytes()
+            # Mark as recently used
+            os.utime(meta_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return CacheEntry(body=body, **meta)
+
+    def put(self, url: str, response: Response) -> None:
+        meta = {
+            "url": url,
+            "stored_at": time(),
+            "encoding": response.encoding,
+            "headers": {
+                header: response.headers[header]
+                for header in stored_headers
+                if header in response.headers
+            },
+        }
+        meta_path, body_path = self._paths(url)
+        with self._lock:
+            # Write to temporary files first so concurrent runs never read half written entries
+            for path, content in (
+                (body_path, response.content),
+                (meta_path, json.dumps(meta).encode()),
+            ):
+                tmp_path = path.with_suffix(f"{path.suffix}.tmp")
+                tmp_path.write_bytes(content)
+                os.replace(tmp_path, path)
+            self._evict()
+
+    def refresh(self, url: str) -> None:
+        """Restart the TTL of an entry after it has been successfully revalidated"""
+        meta_path, _ = self._paths(url)
+        with self._lock:
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return
+            meta["stored_at"] = time()
+            meta_path.write_text(json.dumps(meta))
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self.directory.glob("*.json"):
+                self._remove(path)
+        logger.info(f"Cleared response cache in {self.directory}.")
+
+    def _remove(self, meta_path: Path) -> None:
+        meta_path.with_suffix(".body").unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until the cache fits into max_size"""
+        entries = []
+        total_size = 0
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                size = (
+                    meta_path.stat().st_size
+                    + meta_path.with_suffix(".body").stat().st_size
+                )
+                entries.append((meta_path.stat().st_mtime, size, meta_path))
+            except FileNotFoundError:
+                continue
+            total_size += size
+
+        for _, size, meta_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.debug(f"Evicting {meta_path.stem} from response cache.")
+            self._remove(meta_path)
+            total_size -= size
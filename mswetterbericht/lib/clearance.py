@@ -0,0 +1,84 @@
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+@attr.define(kw_only=True)
+class Clearance:
+    """Cookies of a solved Cloudflare challenge and the User-Agent they were issued to"""
+
+    user_agent: str
+    # Keyword arguments of 'RequestsCookieJar.set' per cookie
+    cookies: list
+    # Unix timestamp the clearance expires at
+    expires_at: float
+
+
+@attr.define(kw_only=True)
+class ClearanceStore:
+    """Solved Cloudflare challenges per host and scraper profile in a small SQLite database
+
+    Clearances are shared by all processes using the same database, so a challenge only has to be solved once
+    until its cookies expire. Expired clearances are never returned.
+    """
+
+    path: Path = attr.field(converter=Path)
+    _connection: sqlite3.Connection = attr.field(init=False)
+    _lock: Lock = attr.field(factory=Lock, init=False)
+
+    def __attrs_post_init__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # The connection is shared by the threads of the run, the lock serialises its usage. Other processes may
+        # write at the same time, so wait a bit for their locks.
+        self._connection = sqlite3.connect(
+            self.path, timeout=10, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS clearances ("
+                "host TEXT, profile TEXT, user_agent TEXT, cookies TEXT, expires_at REAL, "
+                "PRIMARY KEY (host, profile))"
+            )
+
+    def put(self, host: str, profile: str, clearance: Clearance) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO clearances VALUES (?, ?, ?, ?, ?)",
+                (
+                    host,
+                    profile,
+                    clearance.user_agent,
+                    json.dumps(clearance.cookies),
+                    clearance.expires_at,
+                ),
+            )
+
+    def get(self, host: str, profile: str) -> Clearance | None:
+        """@return: The clearance stored for host and profile, None if there's none or it expired"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT user_agent, cookies, expires_at FROM clearances WHERE host = ? AND profile = ?",
+                (host, profile),
+            ).fetchone()
+        if row is None:
+            return None
+        user_agent, cookies, expires_at = row
+        if expires_at <= time():
+            return None
+        return Clearance(
+            user_agent=user_agent, cookies=json.loads(cookies), expires_at=expires_at
+        )
+
+    def delete(self, host: str, profile: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM clearances WHERE host = ? AND profile = ?",
+                (host, profile),
+            )
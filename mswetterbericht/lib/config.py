@@ -0,0 +1,360 @@
+import logging
+import os
+import pickle
+from hashlib import sha256
+from pathlib import Path
+
+import attr
+
+from mswetterbericht.lib.templates import compile_template
+
+logger = logging.getLogger(__name__)
+
+# Increase whenever the structure of CompiledConfig changes, so stale caches aren't used anymore
+config_cache_version = 4
+# Compiled configurations kept in the cache, the least recently written ones are removed
+max_cached_configs = 10
+
+# Values available to the templates, typos are reported before anything is fetched
+instrument_line_keys = {
+    "verb",
+    "change_word",
+    "description",
+    "url",
+    "pct_change",
+    "absolute_value",
+}
+weekly_line_keys = instrument_line_keys | {"month_change", "ytd_change", "volatility"}
+stale_line_keys = instrument_line_keys | {"as_of"}
+# The error line is used for the weather as well
+error_line_keys = {"description", "url", "verb"}
+weather_line_keys = {"url", "forecast", "location"}
+talk_keys = {"prose_lines", "weather_line"}
+weekly_talk_keys = {"prose_lines"}
+
+# Keys every instrument needs after applying the defaults and their types
+instrument_schema = {
+    "description": str,
+    "url": str,
+    "plural": bool,
+    "priority": int,
+    "type": str,
+}
+prose_properties = ("green", "red", "unchanged")
+prose_prefixes = ("heavy", "light")
+
+
+class ConfigError(Exception):
+    """Raised for invalid configuration files, contains all problems found"""
+
+    def __init__(self, problems: list):
+        super().__init__(
+            "Invalid configuration:\n" + "\n".join(f"- {p}" for p in problems)
+        )
+        self.problems = problems
+
+
+@attr.define(kw_only=True)
+class CompiledConfig:
+    """Validated content of the prose and instruments files, with the defaults applied to every instrument"""
+
+    prose: dict
+    instruments: dict
+
+
+def compile_config(
+    instruments_file, prose_file, cache_dir: Path | None = None
+) -> CompiledConfig:
+    """Load, validate and resolve the configuration files, using a cached result if the files didn't change
+
+    @param instruments_file: YAML file with the instruments and lines
+    @param prose_file: YAML file with prose words
+    @param cache_dir: Directory for compiled configurations, None to always compile
+    @return: The CompiledConfig
+    @raise ConfigError: If any of the files is invalid, including YAML syntax errors
+    """
+    with open(instruments_file, "rb") as f:
+        instruments_content = f.read()
+    with open(prose_file, "rb") as f:
+        prose_content = f.read()
+    key = sha256(
+        b"\0".join(
+            [str(config_cache_version).encode(), instruments_content, prose_content]
+        )
+    ).hexdigest()
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{key}.pickle"
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring broken config cache {cache_path}: {e}")
+
+    prose = load_yaml(prose_content, prose_file)
+    instruments = load_yaml(instruments_content, instruments_file)
+    problems = validate_prose(prose) + validate_instruments(instruments, prose)
+    if problems:
+        raise ConfigError(problems)
+    config = CompiledConfig(prose=prose, instruments=resolve_defaults(instruments))
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(config, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        prune_cache(cache_path.parent)
+    return config
+
+
+def load_yaml(content, file_name) -> object:
+    """Parse the YAML content of the file file_name
+
+    @raise ConfigError: If content isn't valid YAML
+    """
+    # Heavy import, only load it when it's actually needed
+    from ruamel.yaml import YAML, YAMLError
+
+    try:
+        return YAML(typ="safe").load(content)
+    except YAMLError as e:
+        location = ""
+        if mark := getattr(e, "problem_mark", None):
+            location = f" (line {mark.line + 1}, column {mark.column + 1})"
+        problem = getattr(e, "problem", None) or str(e)
+        raise ConfigError([f"{file_name}: invalid YAML{location}: {problem}"])
+
+
+def prune_cache(cache_dir: Path) -> None:
+    """Remove all but the 'max_cached_configs' most recently written compiled configurations"""
+    cached = sorted(
+        cache_dir.glob("*.pickle"), key=lambda path: path.stat().st_mtime, reverse=True
+    )
+    for path in cached[max_cached_configs:]:
+        path.unlink(missing_ok=True)
+
+
+def deep_merge(base: dict, overlay: dict) -> dict:
+    """Merge overlay into a copy of base, mappings are merged recursively while all other values are replaced"""
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def apply_overlay(config: CompiledConfig, overlay: dict) -> CompiledConfig:
+    """Create a variant of config, e.g. with other lines or prose for another subreddit
+
+    @param config: The CompiledConfig to start from
+    @param overlay: Mapping with the optional keys 'prose' and 'instruments', which are merged into the content of
+    the respective files (see 'deep_merge'). Defaults of the overlay only fill keys missing in the instruments.
+    @return: The validated CompiledConfig of the variant
+    @raise ConfigError: If the variant is invalid
+    """
+    prose = deep_merge(config.prose, overlay.get("prose") or {})
+    instruments = deep_merge(config.instruments, overlay.get("instruments") or {})
+    problems = validate_prose(prose) + validate_instruments(instruments, prose)
+    if problems:
+        raise ConfigError(problems)
+    return CompiledConfig(prose=prose, instruments=resolve_defaults(instruments))
+
+
+def resolve_defaults(instruments_data: dict) -> dict:
+    """Apply the defaults to every instrument, the returned instruments data has no defaults left"""
+    defaults = instruments_data.get("defaults") or {}
+    resolved = {key: value for key, value in instruments_data.items()}
+    resolved["defaults"] = {}
+    resolved["instruments"] = {
+        data_provider: [{**defaults, **instrument} for instrument in instruments_list]
+        for data_provider, instruments_list in instruments_data["instruments"].items()
+        if instruments_list
+    }
+    return resolved
+
+
+def check_template(template, path: str, keys: set, problems: list) -> None:
+    """Compile template and check it only uses keys, a list is checked item by item"""
+    templates = template if isinstance(template, list) else [template]
+    for i, item in enumerate(templates):
+        item_path = path if len(templates) == 1 else f"{path}[{i}]"
+        if not isinstance(item, str):
+            problems.append(f"{item_path}: expected a string")
+            continue
+        try:
+            unknown = compile_template(item).keys - keys
+        except ValueError as e:
+            problems.append(f"{item_path}: {e}")
+            continue
+        if unknown:
+            problems.append(
+                f"{item_path}: unknown fields {sorted(unknown)}, available are {sorted(keys)}"
+            )
+
+
+def check_word_lists(section: dict, name: str, keys: tuple, problems: list) -> None:
+    if not isinstance(section, dict):
+        problems.append(f"{name}: expected a mapping of instrument types")
+        return
+    for instrument_type, words in section.items():
+        if not isinstance(words, dict):
+            problems.append(f"{name}.{instrument_type}: expected a mapping")
+            continue
+        for key in keys:
+            if not words.get(key) or not isinstance(words[key], list):
+                problems.append(
+                    f"{name}.{instrument_type}.{key}: expected a non-empty list"
+                )
+
+
+def check_weather(weather, problems: list) -> None:
+    """Check the optional 'weather' section of the instruments file"""
+    if weather is None:
+        return
+    if not isinstance(weather, dict):
+        problems.append("weather: expected a mapping")
+        return
+    cache_ttl_hours = weather.get("cache_ttl_hours", 0)
+    if not isinstance(cache_ttl_hours, (int, float)) or cache_ttl_hours < 0:
+        problems.append("weather.cache_ttl_hours: expected a non-negative number")
+    locations = weather.get("locations", [])
+    if not isinstance(locations, list):
+        problems.append("weather.locations: expected a list")
+        return
+    for i, location in enumerate(locations):
+        if not isinstance(location, dict) or not all(
+            isinstance(location.get(key), str) for key in ("name", "url")
+        ):
+            problems.append(
+                f"weather.locations[{i}]: expected a mapping with a 'name' and an 'url'"
+            )
+
+
+def check_rate_limits(rate_limits, problems: list) -> None:
+    """Check the optional 'rate_limits' section of the instruments file, see 'lib.web.configure_rate_limits'"""
+    if rate_limits is None:
+        return
+    if not isinstance(rate_limits, dict):
+        problems.append("rate_limits: expected a mapping of hosts")
+        return
+    for host, limit in rate_limits.items():
+        if not isinstance(limit, dict):
+            problems.append(f"rate_limits.{host}: expected a mapping")
+            continue
+        rate = limit.get("rate")
+        if not isinstance(rate, (int, float)) or rate <= 0:
+            problems.append(f"rate_limits.{host}.rate: expected a positive number")
+        burst = limit.get("burst", 1)
+        if not isinstance(burst, int) or burst < 1:
+            problems.append(f"rate_limits.{host}.burst: expected a positive integer")
+
+
+def validate_prose(prose) -> list:
+    """@return: Problems found in the content of the prose file"""
+    if not isinstance(prose, dict):
+        return ["prose file: expected a mapping"]
+    problems = []
+    if "the_talk" not in prose:
+        problems.append("the_talk: missing")
+    else:
+        check_template(prose["the_talk"], "the_talk", talk_keys, problems)
+    if prose.get("the_weekly_talk") is not None:
+        check_template(
+            prose["the_weekly_talk"], "the_weekly_talk", weekly_talk_keys, problems
+        )
+    check_word_lists(prose.get("properties"), "properties", prose_properties, problems)
+    check_word_lists(prose.get("prefixes"), "prefixes", prose_prefixes, problems)
+    return problems
+
+
+def validate_instruments(instruments_data, prose) -> list:
+    """@return: Problems found in the content of the instruments file, prose is required for the types"""
+    if not isinstance(instruments_data, dict):
+        return ["instruments file: expected a mapping"]
+    problems = []
+    lines = instruments_data.get("lines")
+    if not isinstance(lines, dict):
+        problems.append("lines: expected a mapping")
+        lines = {}
+    for key, keys in (("error", error_line_keys), ("weather", weather_line_keys)):
+        if key not in lines:
+            problems.append(f"lines.{key}: missing")
+        else:
+            check_template(lines[key], f"lines.{key}", keys, problems)
+    if lines.get("weekly") is not None:
+        check_template(lines["weekly"], "lines.weekly", weekly_line_keys, problems)
+    if lines.get("stale") is not None:
+        check_template(lines["stale"], "lines.stale", stale_line_keys, problems)
+    instrument_lines = lines.get("instruments")
+    if not isinstance(instrument_lines, dict):
+        problems.append("lines.instruments: expected a mapping of instrument types")
+        instrument_lines = {}
+    for instrument_type, template in instrument_lines.items():
+        check_template(
+            template,
+            f"lines.instruments.{instrument_type}",
+            instrument_line_keys,
+            problems,
+        )
+
+    check_weather(instruments_data.get("weather"), problems)
+    check_rate_limits(instruments_data.get("rate_limits"), problems)
+
+    hedge_delay = instruments_data.get("hedge_delay", 0)
+    if not isinstance(hedge_delay, (int, float)) or hedge_delay < 0:
+        problems.append("hedge_delay: expected a non-negative number")
+
+    defaults = instruments_data.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        problems.append("defaults: expected a mapping")
+        defaults = {}
+    providers = instruments_data.get("instruments")
+    if not isinstance(providers, dict):
+        problems.append("instruments: expected a mapping of data providers")
+        providers = {}
+    properties = (prose or {}).get("properties") or {}
+    prefixes = (prose or {}).get("prefixes") or {}
+    for data_provider, instruments_list in providers.items():
+        if instruments_list is None:
+            continue
+        if not isinstance(instruments_list, list):
+            problems.append(f"instruments.{data_provider}: expected a list")
+            continue
+        for i, instrument in enumerate(instruments_list):
+            path = f"instruments.{data_provider}[{i}]"
+            if not isinstance(instrument, dict):
+                problems.append(f"{path}: expected a mapping")
+                continue
+            instrument = {**defaults, **instrument}
+            for key, expected_type in instrument_schema.items():
+                if key not in instrument:
+                    problems.append(f"{path}.{key}: missing")
+                elif not isinstance(instrument[key], expected_type):
+                    problems.append(f"{path}.{key}: expected {expected_type.__name__}")
+            if (instrument_type := instrument.get("type")) is not None:
+                if instrument_type not in instrument_lines:
+                    problems.append(
+                        f"{path}.type: no line for type '{instrument_type}'"
+                    )
+                if instrument_type not in properties or instrument_type not in prefixes:
+                    problems.append(
+                        f"{path}.type: no prose for type '{instrument_type}'"
+                    )
+            alternatives = instrument.get("alternatives") or []
+            if not isinstance(alternatives, list):
+                problems.append(f"{path}.alternatives: expected a list")
+                continue
+            for j, alternative in enumerate(alternatives):
+                if not isinstance(alternative, dict) or not isinstance(
+                    alternative.get("provider"), str
+                ):
+                    problems.append(
+                        f"{path}.alternatives[{j}]: expected a mapping with a 'provider'"
+                    )
+    return problems
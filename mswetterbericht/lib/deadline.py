@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+import attr
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there's no time left for the current operation"""
+
+
+@attr.define(frozen=True)
+class Deadline:
+    # Point in time according to time.monotonic
+    expires_at: float
+
+    @classmethod
+    def in_seconds(cls, seconds: float) -> "Deadline":
+        return cls(monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+# The deadline of the current context, copied into threads via contextvars.copy_context
+current_deadline: ContextVar[Deadline | None] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+@contextmanager
+def time_limit(seconds: float | None):
+    """Limit the enclosed block to seconds, an already running (shorter) deadline stays in effect
+
+    @param seconds: Time budget in seconds, None to not limit the block
+    @return: The Deadline in effect for the block (or None)
+    """
+    outer = current_deadline.get()
+    if seconds is None:
+        yield outer
+        return
+    inner = Deadline.in_seconds(seconds)
+    if outer is not None and outer.expires_at < inner.expires_at:
+        inner = outer
+    token = current_deadline.set(inner)
+    try:
+        yield inner
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """Seconds left until the current deadline, None if there is none"""
+    if (d := current_deadline.get()) is None:
+        return None
+    return d.remaining()
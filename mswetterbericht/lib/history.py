@@ -0,0 +1,186 @@
+import logging
+import math
+import os
+from datetime import date
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+default_history_dir = (
+    Path(os.environ.get("XDG_DATA_HOME", Path.home() / ".local" / "share"))
+    / "mswetterbericht"
+    / "history"
+)
+
+# Calendar days of the periods compared to the latest quote
+period_days = {"week": 7, "month": 30}
+# Calendar days of daily returns the volatility is calculated from
+volatility_days = 30
+# Daily returns required for a meaningful volatility
+min_volatility_returns = 5
+# Trading days per year, used to annualise the volatility
+trading_days = 252
+# Calendar days to look back for the last quote before a period started, e.g. because of holidays
+max_quote_gap = 14
+
+
+def quote_dtype():
+    """Record of the quote files: the day as proleptic Gregorian ordinal and the quote"""
+    # Heavy import, only load it when it's actually needed
+    import numpy as np
+
+    return np.dtype([("day", "<i4"), ("value", "<f8")])
+
+
+@attr.define(kw_only=True)
+class PeriodChanges:
+    """Changes of an instrument over several periods in percent, None if the history is too short"""
+
+    value: float
+    week: float | None
+    month: float | None
+    ytd: float | None
+    # Annualised standard deviation of the daily returns in percent
+    volatility: float | None
+
+
+@attr.define(kw_only=True)
+class HistoryStore:
+    """Compact local time series of the daily quotes, one file per instrument
+
+    Every file is a plain array of fixed size records (see 'quote_dtype') sorted by day, which is memory mapped
+    for reading so only the requested range is actually read. A day has at most one record, later quotes of the
+    same day replace the earlier one.
+    """
+
+    directory: Path = attr.field(converter=Path)
+    _lock: Lock = attr.field(factory=Lock, init=False)
+
+    def __attrs_post_init__(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{sha256(key.encode()).hexdigest()[:32]}.quotes"
+
+    def append(self, key: str, value: float, day: date | None = None) -> None:
+        """Store the quote of key for day (today by default)"""
+        # Heavy import, only load it when it's actually needed
+        import numpy as np
+
+        dtype = quote_dtype()
+        day = (day or date.today()).toordinal()
+        record = np.array([(day, value)], dtype=dtype).tobytes()
+        path = self._path(key)
+        with self._lock, open(path, "r+b" if path.exists() else "w+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            # Drop a partially written record of an interrupted run
+            size -= size % dtype.itemsize
+            if size:
+                f.seek(size - dtype.itemsize)
+                last_day = np.frombuffer(f.read(dtype.itemsize), dtype=dtype)["day"][0]
+                if day < last_day:
+                    logger.warning(
+                        f"Not storing quote of {key} older than its history."
+                    )
+                    return
+                if day == last_day:
+                    size -= dtype.itemsize
+            f.seek(size)
+            f.write(record)
+            f.truncate()
+
+    def series(self, key: str, since: int = 0) -> tuple:
+        """Get the quotes of key
+
+        @param key: Key of the instrument
+        @param since: First day (as ordinal) to return
+        @return: Tuple of arrays of the days (as ordinals) and the quotes
+        """
+        # Heavy import, only load it when it's actually needed
+        import numpy as np
+
+        dtype = quote_dtype()
+        path = self._path(key)
+        try:
+            count = path.stat().st_size // dtype.itemsize
+        except FileNotFoundError:
+            count = 0
+        if not count:
+            return np.empty(0, dtype="<i4"), np.empty(0, dtype="<f8")
+        quotes = np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+        start = np.searchsorted(quotes["day"], since)
+        # Copy the range, so the file can be closed
+        selected = np.array(quotes[start:])
+        del quotes
+        return selected["day"], selected["value"]
+
+    def period_changes(self, keys: list, today: date | None = None) -> dict:
+        """Calculate the changes over all periods for all keys at once
+
+        The quotes of all keys are aligned in a matrix with one column per calendar day, days without a quote
+        (weekends, holidays, missed runs) carry the previous quote forward.
+
+        @param keys: Keys of the instruments
+        @param today: Day the changes are calculated for, today by default
+        @return: PeriodChanges per key, keys without a quote until today are left out
+        """
+        # Heavy import, only load it when it's actually needed
+        import numpy as np
+
+        today = today or date.today()
+        end = today.toordinal()
+        # The last quote of the previous year is the reference for the YTD change
+        ytd_reference = date(today.year, 1, 1).toordinal() - 1
+        start = min([end - days for days in period_days.values()] + [ytd_reference])
+        start -= max_quote_gap
+
+        quotes = np.full((len(keys), end - start + 1), np.nan)
+        for row, key in enumerate(keys):
+            days, values = self.series(key, since=start)
+            in_range = days <= end
+            quotes[row, days[in_range] - start] = values[in_range]
+
+        # Forward fill the gaps with the last known quote
+        has_quote = ~np.isnan(quotes)
+        last_quote_index = np.where(has_quote, np.arange(quotes.shape[1]), 0)
+        np.maximum.accumulate(last_quote_index, axis=1, out=last_quote_index)
+        filled = np.take_along_axis(quotes, last_quote_index, axis=1)
+
+        current = filled[:, -1]
+        references = filled[
+            :,
+            [end - days - start for days in period_days.values()]
+            + [ytd_reference - start],
+        ]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            changes = (current[:, np.newaxis] / references - 1) * 100
+            # Only days with an actual quote have a return
+            returns = np.diff(np.log(filled[:, -volatility_days - 1 :]), axis=1)
+        returns[~has_quote[:, -volatility_days:]] = np.nan
+        return_counts = np.count_nonzero(~np.isnan(returns), axis=1)
+        volatility = np.full(len(keys), np.nan)
+        enough_returns = return_counts >= min_volatility_returns
+        volatility[enough_returns] = (
+            np.nanstd(returns[enough_returns], axis=1) * math.sqrt(trading_days) * 100
+        )
+
+        def to_float(value) -> float | None:
+            return None if not np.isfinite(value) else round(float(value), 2)
+
+        period_changes = {}
+        for row, key in enumerate(keys):
+            if np.isnan(current[row]):
+                continue
+            week, month, ytd = (to_float(change) for change in changes[row])
+            period_changes[key] = PeriodChanges(
+                value=float(current[row]),
+                week=week,
+                month=month,
+                ytd=ytd,
+                volatility=to_float(volatility[row]),
+            )
+        return period_changes
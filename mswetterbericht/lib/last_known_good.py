@@ -0,0 +1,71 @@
+import logging
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+@attr.define(kw_only=True)
+class LastKnownQuote:
+    """The latest successfully fetched values of an instrument"""
+
+    pct_change: float
+    absolute_value: float
+    # Unix timestamp of the run the values were fetched in
+    fetched_at: float
+
+
+@attr.define(kw_only=True)
+class LastKnownGoodStore:
+    """Latest successful quote per instrument in a small SQLite database
+
+    Instruments which can't be fetched in time are rendered from it instead of with the error line. Unlike the
+    'HistoryStore', only the latest quote is kept, keyed by data provider and symbol.
+    """
+
+    path: Path = attr.field(converter=Path)
+    _connection: sqlite3.Connection = attr.field(init=False)
+    _lock: Lock = attr.field(factory=Lock, init=False)
+
+    def __attrs_post_init__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # The connection is shared by the threads of the run, the lock serialises its usage
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS quotes ("
+                "key TEXT PRIMARY KEY, pct_change REAL, absolute_value REAL, fetched_at REAL)"
+            )
+
+    def put_many(self, quotes: dict) -> None:
+        """Store the quotes of a run in a single transaction
+
+        @param quotes: Dict mapping the keys to InstrumentValues (or anything with 'pct_change' and 'absolute_value')
+        """
+        fetched_at = time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?)",
+                [
+                    (key, values.pct_change, values.absolute_value, fetched_at)
+                    for key, values in quotes.items()
+                ],
+            )
+
+    def get(self, key: str) -> LastKnownQuote | None:
+        """@return: The latest quote stored for key, None if there's none"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT pct_change, absolute_value, fetched_at FROM quotes WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        pct_change, absolute_value, fetched_at = row
+        return LastKnownQuote(
+            pct_change=pct_change, absolute_value=absolute_value, fetched_at=fetched_at
+        )
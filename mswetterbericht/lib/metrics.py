@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, current_thread
+from time import perf_counter, time
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+# Prefix of all metrics in the Prometheus textfile
+metric_prefix = "mswetterbericht"
+
+# Labels only written to the JSON trace, e.g. free text. Prometheus metrics are aggregated over them, so the amount
+# of series stays bounded.
+trace_only_labels = ("instrument",)
+
+
+@attr.define(kw_only=True)
+class Span:
+    """A timed stage of the run, e.g. loading the config or a single HTTP request"""
+
+    name: str
+    start: float
+    duration: float = 0.0
+    thread: str
+    labels: dict
+
+
+@attr.define(kw_only=True)
+class Recorder:
+    """Thread-safe collector for timings (spans) and counters of a run
+
+    Labels should have a low cardinality, as they end up as Prometheus labels.
+    """
+
+    spans: list = attr.field(factory=list)
+    counters: Counter = attr.field(factory=Counter)
+    _lock: Lock = attr.field(factory=Lock, init=False)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Time the enclosed block, labels can still be added to the yielded dict within the block"""
+        s = Span(name=name, start=time(), thread=current_thread().name, labels=labels)
+        start = perf_counter()
+        try:
+            yield s.labels
+        finally:
+            s.duration = perf_counter() - start
+            with self._lock:
+                self.spans.append(s)
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def total(self, name: str) -> float:
+        """Sum of the counter name over all its labels"""
+        with self._lock:
+            return sum(
+                value
+                for (counter_name, _), value in self.counters.items()
+                if counter_name == name
+            )
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "spans": [attr.asdict(s) for s in self.spans],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+            }
+
+    def write_json_trace(self, path) -> None:
+        write_atomically(path, json.dumps(self.to_dict(), indent=2, default=str))
+        logger.debug(f"Wrote JSON trace to {path}.")
+
+    def write_prometheus_textfile(self, path) -> None:
+        """Write all metrics for the textfile collector of the Prometheus node exporter
+
+        Spans are aggregated per name and labels into '_duration_seconds_sum' and '_count' metrics, counters
+        ending with '_total' are written as Prometheus counters. Labels of 'trace_only_labels' are left out.
+        """
+        durations = Counter()
+        counts = Counter()
+        counters = Counter()
+        with self._lock:
+            for s in self.spans:
+                key = (s.name, prometheus_labels(s.labels.items()))
+                durations[key] += s.duration
+                counts[key] += 1
+            for (name, labels), value in self.counters.items():
+                counters[(name, prometheus_labels(labels))] += value
+
+        lines = []
+        for suffix, values in (
+            ("_duration_seconds_sum", durations),
+            ("_duration_seconds_count", counts),
+            ("", counters),
+        ):
+            for name in sorted({name for name, _ in values}):
+                metric = f"{metric_prefix}_{name}{suffix}"
+                metric_type = "counter" if metric.endswith("_total") else "gauge"
+                lines.append(f"# TYPE {metric} {metric_type}")
+                for (value_name, labels), value in sorted(values.items()):
+                    if value_name == name:
+                        lines.append(f"{metric}{format_labels(labels)} {value}")
+        lines.append(f"# TYPE {metric_prefix}_last_run_timestamp_seconds gauge")
+        lines.append(f"{metric_prefix}_last_run_timestamp_seconds {time()}")
+        write_atomically(path, "\n".join(lines) + "\n")
+        logger.debug(f"Wrote Prometheus textfile to {path}.")
+
+
+def prometheus_labels(labels) -> tuple:
+    """Sorted labels without the 'trace_only_labels'"""
+    return tuple(
+        sorted((key, value) for key, value in labels if key not in trace_only_labels)
+    )
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " "))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def write_atomically(path, content: str) -> None:
+    """Write content to a temporary file first, so readers like the node exporter never see partial files"""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(content)
+    os.replace(tmp_path, path)
+
+
+# Process-wide recorder used by all modules
+recorder = Recorder()
@@ -0,0 +1,30 @@
+import logging
+from importlib.util import find_spec
+
+from mswetterbericht.lib.metrics import recorder
+
+logger = logging.getLogger(__name__)
+
+# lxml is a lot faster than Pythons own HTML parser, but optional
+html_parser = "lxml" if find_spec("lxml") is not None else "html.parser"
+
+
+def parse_html(markup: str, name=None, attrs=None, **kwargs):
+    """Parse only the elements of markup matching the SoupStrainer arguments (and their children)
+
+    Everything outside the matching elements is skipped while parsing, which is a lot faster and leaner than
+    parsing the whole page. The result can be searched with the same selectors as a completely parsed page.
+
+    @param markup: The HTML to parse
+    @param name: Tag name(s) of the elements to keep
+    @param attrs: Attributes of the elements to keep
+    @param kwargs: Further SoupStrainer arguments, e.g. 'class_'
+    @return: BeautifulSoup object only containing the matching elements
+    """
+    # Heavy import, only load it when it's actually needed
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    with recorder.span("parse", parser=html_parser):
+        return BeautifulSoup(
+            markup, html_parser, parse_only=SoupStrainer(name, attrs, **kwargs)
+        )
@@ -0,0 +1,95 @@
+import logging
+import sys
+from importlib.abc import Loader, MetaPathFinder
+from threading import Lock, local
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+
+class TimedLoader(Loader):
+    """Loader proxy measuring the time spent executing a module"""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profiler.stack
+        stack.append(0.0)
+        start = perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = perf_counter() - start
+            nested = stack.pop()
+            self._profiler.record(module.__name__, cumulative, nested, len(stack))
+            if stack:
+                stack[-1] += cumulative
+
+
+class ImportProfiler(MetaPathFinder):
+    """Measures the time of every import happening after 'install', like 'python -X importtime'"""
+
+    def __init__(self):
+        # module name -> (self time, cumulative time, import depth)
+        self.timings = {}
+        self._lock = Lock()
+        self._local = local()
+        self._start = perf_counter()
+
+    @property
+    def stack(self) -> list:
+        """Per-thread stack of nested import times for currently executing modules"""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def install(self) -> "ImportProfiler":
+        sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self) -> None:
+        sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            if (spec := finder.find_spec(fullname, path, target)) is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = TimedLoader(spec.loader, self)
+        return spec
+
+    def record(self, name: str, cumulative: float, nested: float, depth: int) -> None:
+        with self._lock:
+            self.timings[name] = (cumulative - nested, cumulative, depth)
+
+    def report(self, limit: int = 15) -> str:
+        """Report the slowest top level imports and the overall time since installing the profiler"""
+        top_level = sorted(
+            (
+                (cumulative, self_time, name)
+                for name, (self_time, cumulative, depth) in self.timings.items()
+                if depth == 0
+            ),
+            reverse=True,
+        )
+        total_imports = sum(cumulative for cumulative, _, _ in top_level)
+        lines = [
+            f"Imported {len(self.timings)} modules in {total_imports:.3f}s "
+            f"({perf_counter() - self._start:.3f}s since start of profiling)",
+            f"{'cumulative':>10} {'self':>8}  module",
+        ]
+        for cumulative, self_time, name in top_level[:limit]:
+            lines.append(f"{cumulative:>9.3f}s {self_time:>7.3f}s  {name}")
+        return "\n".join(lines)
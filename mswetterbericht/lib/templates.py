@@ -0,0 +1,142 @@
+import logging
+from functools import lru_cache
+from string import Formatter
+from typing import Callable
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+formatter = Formatter()
+
+
+@attr.define(frozen=True)
+class Field:
+    """A replacement field of a template, e.g. '{pct_change:>8}'"""
+
+    name: str
+    format_spec: str
+    conversion: str | None
+    # Applied to the formatted value, see 'compile_template'
+    transform: Callable | None = None
+
+    @property
+    def key(self) -> str:
+        """Name of the keyword argument the field is looked up in"""
+        return self.name.partition(".")[0].partition("[")[0]
+
+    @property
+    def template(self) -> str:
+        """The field in the syntax of 'str.format'"""
+        conversion = f"!{self.conversion}" if self.conversion else ""
+        format_spec = f":{self.format_spec}" if self.format_spec else ""
+        return f"{{{self.name}{conversion}{format_spec}}}"
+
+    def render(self, values: dict) -> str:
+        rendered = self.template.format_map(values)
+        if self.transform is not None:
+            return self.transform(rendered)
+        return rendered
+
+
+@attr.define
+class RenderPlan:
+    """A compiled template, which only has to splice in the values of its fields when rendering
+
+    Rendering is equivalent to 'str.format', but the template is only parsed once and static parts are already
+    transformed. Untransformed fields are rendered by a single 'str.format' call, transformed fields are rendered
+    beforehand and passed as positional arguments.
+    """
+
+    # Literal strings and Fields in order of output
+    segments: tuple
+    _format_string: str = attr.field(init=False)
+    _transformed_fields: tuple = attr.field(init=False)
+
+    def __attrs_post_init__(self):
+        parts = []
+        transformed_fields = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                parts.append(segment.replace("{", "{{").replace("}", "}}"))
+            elif segment.transform is not None:
+                parts.append(f"{{{len(transformed_fields)}}}")
+                transformed_fields.append(segment)
+            else:
+                parts.append(segment.template)
+        self._format_string = "".join(parts)
+        self._transformed_fields = tuple(transformed_fields)
+
+    @property
+    def keys(self) -> set:
+        """Keyword arguments required for rendering"""
+        return {segment.key for segment in self.segments if isinstance(segment, Field)}
+
+    def render(self, **values) -> str:
+        return self.render_map(values)
+
+    def render_map(self, values: dict) -> str:
+        """Like 'render', but takes the values as dict like 'str.format_map'"""
+        if self._transformed_fields:
+            return self._format_string.format(
+                *[field.render(values) for field in self._transformed_fields],
+                **values,
+            )
+        return self._format_string.format_map(values)
+
+    def bind(self, **values) -> "RenderPlan":
+        """Render the fields of values into the static parts, e.g. values which are fixed per instrument
+
+        @return: A new RenderPlan only requiring the remaining values
+        """
+        segments = []
+        for segment in self.segments:
+            if isinstance(segment, Field) and segment.key in values:
+                try:
+                    segment = segment.render(values)
+                except KeyError:
+                    # The format spec requires further values
+                    pass
+            if isinstance(segment, str) and segments and isinstance(segments[-1], str):
+                segments[-1] += segment
+            elif segment != "":
+                segments.append(segment)
+        return RenderPlan(tuple(segments))
+
+    def __add__(self, other: "RenderPlan") -> "RenderPlan":
+        return RenderPlan(self.segments + other.segments).bind()
+
+
+@lru_cache(maxsize=None)
+def compile_template(
+    template: str, transform: Callable | None = None, reverse: bool = False
+) -> RenderPlan:
+    """Compile a format string template into a RenderPlan, compiled templates are cached
+
+    @param template: Template in the syntax of 'str.format'
+    @param transform: Function applied to the output (e.g. 'upsidedown.transform'), has to work piecewise: the
+    static parts are transformed right away, the field values after rendering
+    @param reverse: Whether transform reverses the order of the characters, so the segments have to be reversed
+    @return: The RenderPlan of template
+    """
+    segments = []
+    for literal, name, format_spec, conversion in formatter.parse(template):
+        if literal:
+            segments.append(transform(literal) if transform is not None else literal)
+        if name is None:
+            continue
+        if name == "" or name.isdigit():
+            raise ValueError(
+                f"Positional fields aren't supported in templates: {template}"
+            )
+        segments.append(
+            Field(
+                name=name,
+                format_spec=format_spec,
+                conversion=conversion,
+                transform=transform,
+            )
+        )
+    if reverse:
+        segments.reverse()
+    return RenderPlan(tuple(segments)).bind()
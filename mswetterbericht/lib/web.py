@@ -1,43 +1,719 @@
+import asyncio
 import logging
-from time import sleep
+import shutil
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from importlib.util import find_spec
+from pathlib import Path
+from random import uniform
+from threading import Lock
+from time import monotonic, perf_counter, sleep, time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit, urlunsplit
+from weakref import WeakKeyDictionary
 
-import cloudscraper
+import attr
 from requests.models import Response
 
+from mswetterbericht.lib import deadline
+from mswetterbericht.lib.cache import ResponseCache, default_max_size
+from mswetterbericht.lib.clearance import Clearance, ClearanceStore
+from mswetterbericht.lib.deadline import DeadlineExceeded
+from mswetterbericht.lib.metrics import recorder
+
+if TYPE_CHECKING:
+    import cloudscraper
+
 logger = logging.getLogger(__name__)
 
+# Keyword arguments for cloudscraper.create_scraper per scraper profile, the interpreter is set by 'get_session'
+scraper_profiles = {
+    "default": {},
+    # Taken from https://github.com/alvarobartt/investiny/issues/71
+    "android": {
+        "browser": {"browser": "chrome", "platform": "android", "desktop": False}
+    },
+}
+
+# Interpreters for Cloudflare's JavaScript challenges in order of preference, js2py is by far the slowest
+interpreter_preference = ("nodejs", "v8", "js2py")
+# Interpreter used if none of 'interpreter_preference' is installed, cloudscraper's own pure Python solver
+fallback_interpreter = "native"
+# Interpreter chosen via 'configure_interpreter', None to pick the first installed one of 'interpreter_preference'
+js_interpreter: str | None = None
+
+# Cookies Cloudflare sets for a solved challenge, 'cf_clearance' is the proof of the solution
+clearance_cookie_names = ("cf_clearance", "__cf_bm")
+# Seconds a clearance is reused if its cookie doesn't expire by itself
+default_clearance_ttl = 30 * 60
+# Optional persistent store of solved challenges, enabled via 'configure_clearance'
+clearance_store: ClearanceStore | None = None
+
+# Amount of keep-alive connections per session, should cover the concurrency of the data providers
+pool_maxsize = 10
+
+# Shared scraper sessions, keyed by host and scraper profile
+sessions = {}
+sessions_lock = Lock()
+
+# Shared httpx.AsyncClients per event loop, keyed by host
+async_clients = WeakKeyDictionary()
+# The async transport doesn't get a browser User-Agent from cloudscraper
+async_user_agent = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/110.0"
+)
+
+# Upper bounds in seconds for connecting and reading, lowered further by the time left of a deadline
+connect_timeout = 10
+read_timeout = 30
+
+# Hosts whose requests are sent to another base URL instead, e.g. a local stub server for benchmarks
+redirected_hosts = {}
+
+# Optional persistent response cache, enabled via 'configure_cache'
+response_cache: ResponseCache | None = None
+
+# Statuses worth retrying, all others fail right away
+retryable_status_codes = {429, 500, 502, 503, 504}
+# Backoff times are randomised by this share in both directions, so concurrent retries don't hit a host at once
+backoff_jitter = 0.5
+# Longest Retry-After waited for before giving up
+max_retry_after = 60
+
+# Failed attempts after which further requests to a host fail right away
+circuit_failure_threshold = 3
+# Statuses counting as failure of the host, unlike e.g. a 404 of a single dead URL. A 403 isn't one either, Cloudflare
+# answers challenges with it, which the next request may pass with a new clearance.
+circuit_failure_status_codes = retryable_status_codes
+# Seconds until a host with an open circuit gets another try
+circuit_reset_timeout = 120
+
+
+class RequestError(Exception):
+    """Raised when a request didn't get a usable response, the instrument gets the error line"""
+
+    def __init__(self, url: str, message: str):
+        super().__init__(f"{message} ({url})")
+        self.url = url
+
+
+class StatusError(RequestError):
+    """The response has a status which isn't worth retrying, e.g. 403 or 404"""
+
+    def __init__(self, url: str, status_code: int):
+        super().__init__(url, f"Unexpected HTTP {status_code}")
+        self.status_code = status_code
+
+
+class RetriesExhaustedError(RequestError):
+    """All retries got retryable statuses (see 'retryable_status_codes') or the host asked to wait too long"""
+
+    def __init__(self, url: str, status_code: int, tries: int):
+        super().__init__(url, f"Still got HTTP {status_code} after {tries} tries")
+        self.status_code = status_code
+
+
+class CircuitOpenError(RequestError):
+    """The host failed too often recently, so the request wasn't even sent, see 'CircuitBreaker'"""
+
+
+@attr.define
+class CircuitBreaker:
+    """Let requests to a failing host fail fast instead of going through all retries each
+
+    After 'failure_threshold' consecutive failed attempts (exceptions and 'circuit_failure_status_codes') the
+    circuit of the host opens and requests raise CircuitOpenError. After 'reset_timeout' seconds a single request
+    is let through again, the circuit closes with its first success.
+    """
+
+    failure_threshold: int = circuit_failure_threshold
+    reset_timeout: float = circuit_reset_timeout
+    # Consecutive failures per host
+    _failures: dict = attr.field(factory=dict, init=False)
+    # time.monotonic the circuit of a host opened at
+    _opened_at: dict = attr.field(factory=dict, init=False)
+    _lock: Lock = attr.field(factory=Lock, init=False)
+
+    def check(self, url: str) -> None:
+        """@raise CircuitOpenError: If the circuit of the host of url is open"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if (opened_at := self._opened_at.get(host)) is None:
+                return
+            if monotonic() - opened_at >= self.reset_timeout:
+                # Let this request probe the host, the others keep failing until it's done
+                self._opened_at[host] = monotonic()
+                return
+        recorder.increment("http_circuit_rejections_total", host=host)
+        raise CircuitOpenError(url, f"Circuit of {host} is open")
+
+    def record_success(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+
+    def record_failure(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._failures[host] = failures = self._failures.get(host, 0) + 1
+            if failures < self.failure_threshold or host in self._opened_at:
+                return
+            self._opened_at[host] = monotonic()
+        logger.warning(f"{host} failed {failures} times, opening its circuit.")
+        recorder.increment("http_circuit_opened_total", host=host)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._failures.clear()
+            self._opened_at.clear()
+
+
+# Shared by all requests of the process
+circuit_breaker = CircuitBreaker()
+
+
+@attr.define
+class TokenBucket:
+    """Rate limit for the requests to a host, shared by all threads and event loops
+
+    Requests take a token each, tokens refill at 'rate' per second up to 'burst'. Waiting happens outside the lock
+    (see 'reserve'), so threads and coroutines queue up without blocking each other or an event loop.
+    """
+
+    # Requests per second
+    rate: float
+    # Requests allowed at once after the host was idle
+    burst: int = 1
+    _tokens: float = attr.field(init=False)
+    _updated: float = attr.field(factory=monotonic, init=False)
+    _lock: Lock = attr.field(factory=Lock, init=False)
+
+    def __attrs_post_init__(self):
+        self._tokens = float(self.burst)
+
+    def reserve(self, max_wait: float | None = None) -> float | None:
+        """Take a token, which may only become available in the future
+
+        @param max_wait: Seconds the caller is willing to wait at most
+        @return: Seconds to wait before sending the request, None if that's longer than max_wait (no token is taken)
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Negative tokens are requests already waiting for their turn
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1
+        return wait
+
+
+# Rate limits per host, set via 'configure_rate_limits'
+rate_limits = {}
+rate_limits_lock = Lock()
+
+
+def configure_rate_limits(limits: dict) -> None:
+    """Set the rate limits per host, buckets of unchanged limits keep their state
+
+    @param limits: Mapping of hosts to mappings with the requests per second ('rate') and optionally the 'burst'
+    """
+    with rate_limits_lock:
+        for host in list(rate_limits):
+            if host not in limits:
+                del rate_limits[host]
+        for host, limit in limits.items():
+            bucket = TokenBucket(rate=limit["rate"], burst=limit.get("burst", 1))
+            current = rate_limits.get(host)
+            if current is None or (current.rate, current.burst) != (
+                bucket.rate,
+                bucket.burst,
+            ):
+                rate_limits[host] = bucket
+
+
+def rate_limit_delay(url: str) -> float:
+    """Reserve a request to the host of url according to its rate limit
+
+    @return: Seconds to wait before sending the request
+    @raise DeadlineExceeded: If the request's turn would come after the current deadline
+    """
+    host = urlsplit(url).netloc
+    if (bucket := rate_limits.get(host)) is None:
+        return 0.0
+    if (wait := bucket.reserve(deadline.remaining())) is None:
+        raise DeadlineExceeded(f"The rate limit of {host} doesn't allow {url} in time.")
+    if wait:
+        recorder.increment("http_rate_limit_wait_seconds_total", wait, host=host)
+    return wait
+
+
+def acquire_rate_limit(url: str) -> None:
+    """Wait until the rate limit of the host of url allows another request, see 'rate_limit_delay'"""
+    if wait := rate_limit_delay(url):
+        sleep(wait)
+
+
+async def async_acquire_rate_limit(url: str) -> None:
+    """Async variant of 'acquire_rate_limit', which doesn't block the event loop"""
+    if wait := rate_limit_delay(url):
+        await asyncio.sleep(wait)
+
+
+def configure_cache(directory, max_size: int = default_max_size) -> ResponseCache:
+    """Enable the persistent response cache for all requests with a cache_ttl
+
+    @param directory: Directory to store the cached responses in
+    @param max_size: Size in bytes after which the least recently used responses are evicted
+    @return: The configured ResponseCache
+    """
+    global response_cache
+    response_cache = ResponseCache(directory=directory, max_size=max_size)
+    return response_cache
+
+
+def configure_interpreter(name: str | None) -> None:
+    """Choose the interpreter cloudscraper solves JavaScript challenges with
+
+    @param name: Name of a cloudscraper interpreter (e.g. 'nodejs', 'v8' or 'js2py'), None to pick the first
+    installed one of 'interpreter_preference'
+    """
+    global js_interpreter
+    js_interpreter = name
+
+
+@lru_cache(maxsize=None)
+def installed_interpreter() -> str:
+    """The first installed interpreter of 'interpreter_preference', 'fallback_interpreter' if there's none"""
+    available = {
+        "nodejs": lambda: shutil.which("node") is not None,
+        "v8": lambda: find_spec("v8eval") is not None,
+        "js2py": lambda: find_spec("js2py") is not None,
+    }
+    for name in interpreter_preference:
+        if available.get(name, lambda: False)():
+            logger.debug(f"Solving Cloudflare challenges with {name}.")
+            return name
+    return fallback_interpreter
+
+
+def configure_clearance(directory) -> ClearanceStore:
+    """Persist solved Cloudflare challenges, so they're reused across sessions, runs and processes
+
+    @param directory: Directory to store the clearances in
+    @return: The configured ClearanceStore
+    """
+    global clearance_store
+    clearance_store = ClearanceStore(path=Path(directory) / "clearance.sqlite")
+    return clearance_store
+
+
+def get_session(url: str, profile: str = "default") -> "cloudscraper.CloudScraper":
+    """Get the process-wide scraper session for the host of url
+
+    Sessions are created once per host and scraper profile, so connections, cookies and solved
+    Cloudflare challenges are reused by all requests (and threads) to that host. New sessions start with the
+    stored clearance of their host, see 'restore_clearance'.
+
+    @param url: URL which is going to be requested with the session
+    @param profile: Name of the scraper profile in 'scraper_profiles'
+    @return: The shared CloudScraper session
+    """
+    # Heavy import, only load it when it's actually needed
+    import cloudscraper
+    from cloudscraper import CipherSuiteAdapter
+
+    key = (urlsplit(url).netloc, profile)
+    with sessions_lock:
+        if (session := sessions.get(key)) is None:
+            session = cloudscraper.create_scraper(
+                interpreter=js_interpreter or installed_interpreter(),
+                **scraper_profiles[profile],
+            )
+            # Replace the default adapter to keep more than one connection per host alive
+            session.mount(
+                "https://",
+                CipherSuiteAdapter(
+                    cipherSuite=session.cipherSuite,
+                    ecdhCurve=session.ecdhCurve,
+                    pool_connections=1,
+                    pool_maxsize=pool_maxsize,
+                ),
+            )
+            restore_clearance(session, key[0], profile)
+            sessions[key] = session
+            logger.debug(f"Created '{profile}' scraper session for {key[0]}.")
+    return session
+
+
+def restore_clearance(session, host: str, profile: str) -> None:
+    """Add the stored clearance of host to session, so it doesn't have to solve the challenge again"""
+    if clearance_store is None:
+        return
+    # noinspection PyBroadException
+    try:
+        clearance = clearance_store.get(host, profile)
+    except Exception as e:
+        logger.error(f"Could not look up the clearance of {host}. Error args: {e.args}")
+        return
+    recorder.increment(
+        "cloudflare_clearance_lookups_total",
+        host=host,
+        result="miss" if clearance is None else "hit",
+    )
+    if clearance is None:
+        return
+    # The clearance is only valid for the User-Agent which solved the challenge
+    session.headers["User-Agent"] = clearance.user_agent
+    for cookie in clearance.cookies:
+        session.cookies.set(**cookie)
+    logger.debug(f"Reusing the stored clearance of {host}.")
+
+
+def clearance_values(session) -> set:
+    """Values of the 'cf_clearance' cookies of session"""
+    return {cookie.value for cookie in session.cookies if cookie.name == "cf_clearance"}
+
+
+def save_clearance(session, host: str, profile: str) -> None:
+    """Store the clearance cookies of session, errors only get logged"""
+    cookies = [
+        cookie for cookie in session.cookies if cookie.name in clearance_cookie_names
+    ]
+    expires_at = min(
+        (
+            cookie.expires
+            for cookie in cookies
+            if cookie.name == "cf_clearance" and cookie.expires
+        ),
+        default=time() + default_clearance_ttl,
+    )
+    clearance = Clearance(
+        user_agent=session.headers["User-Agent"],
+        cookies=[
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "expires": cookie.expires,
+            }
+            for cookie in cookies
+        ],
+        expires_at=expires_at,
+    )
+    # noinspection PyBroadException
+    try:
+        clearance_store.put(host, profile, clearance)
+    except Exception as e:
+        logger.error(f"Could not store the clearance of {host}. Error args: {e.args}")
+
+
+def scraper_get(session, url: str, profile: str, **kwargs) -> Response:
+    """'timed_get' for scraper sessions, which records and stores Cloudflare challenges solved by the request
+
+    The solve time is the duration of the whole request, including the delay Cloudflare requires before the
+    solution is submitted. A stored clearance answered with HTTP 403 isn't reused anymore.
+    """
+    host = urlsplit(url).netloc
+    known_clearance = clearance_values(session)
+    start = perf_counter()
+    r = timed_get(session, url, **kwargs)
+    if clearance_values(session) - known_clearance:
+        solve_time = perf_counter() - start
+        logger.info(f"Solved the Cloudflare challenge of {host} in {solve_time:.1f}s.")
+        recorder.increment("cloudflare_challenges_solved_total", host=host)
+        recorder.increment("cloudflare_solve_seconds_total", solve_time, host=host)
+        if clearance_store is not None:
+            save_clearance(session, host, profile)
+    elif r.status_code == 403 and known_clearance and clearance_store is not None:
+        # noinspection PyBroadException
+        try:
+            clearance_store.delete(host, profile)
+        except Exception as e:
+            logger.error(
+                f"Could not remove the clearance of {host}. Error args: {e.args}"
+            )
+    return r
+
+
+def get_async_client(url: str):
+    """Get the httpx.AsyncClient of the running event loop for the host of url
+
+    Like the scraper sessions, clients are shared by all requests to a host so connections are kept alive.
+    Clients are bound to their event loop, see 'close_async_clients'.
+    """
+    # Heavy import, only load it when it's actually needed
+    import httpx
+
+    clients = async_clients.setdefault(asyncio.get_running_loop(), {})
+    host = urlsplit(url).netloc
+    if (client := clients.get(host)) is None:
+        client = httpx.AsyncClient(
+            headers={"User-Agent": async_user_agent},
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize
+            ),
+        )
+        clients[host] = client
+        logger.debug(f"Created async client for {host}.")
+    return client
+
+
+async def close_async_clients() -> None:
+    """Close all clients of the running event loop, has to be awaited before the loop is closed"""
+    clients = async_clients.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+
+def redirect_url(url: str) -> str:
+    """Apply 'redirected_hosts' to url, the original host becomes the first segment of the path"""
+    parts = urlsplit(url)
+    if (base_url := redirected_hosts.get(parts.netloc)) is None:
+        return url
+    base = urlsplit(base_url)
+    return urlunsplit(
+        (
+            base.scheme,
+            base.netloc,
+            f"{base.path.rstrip('/')}/{parts.netloc}{parts.path}",
+            parts.query,
+            parts.fragment,
+        )
+    )
+
+
+def request_timeout() -> tuple:
+    """Connect and read timeout for the next request, derived from the time left of the current deadline"""
+    if (time_left := deadline.remaining()) is None:
+        return connect_timeout, read_timeout
+    if time_left <= 0:
+        raise DeadlineExceeded("No time left for another request.")
+    return min(connect_timeout, time_left), min(read_timeout, time_left)
+
+
+def timed_get(session, url: str, **kwargs) -> Response:
+    """GET url (after applying 'redirected_hosts') with session and record the request in the metrics
+
+    Requests wait for the rate limit of their host (see 'configure_rate_limits'). Requests without an explicit
+    timeout get one according to 'request_timeout'.
+    """
+    host = urlsplit(url).netloc
+    acquire_rate_limit(url)
+    kwargs.setdefault("timeout", request_timeout())
+    with recorder.span("http_request", host=host) as labels:
+        try:
+            r = session.get(redirect_url(url), **kwargs)
+        except Exception:
+            labels["status"] = "exception"
+            raise
+        labels["status"] = r.status_code
+    recorder.increment("http_response_bytes_total", len(r.content), host=host)
+    return r
+
+
+async def async_timed_get(client, url: str, **kwargs):
+    """Async variant of 'timed_get' for httpx.AsyncClients"""
+    # Heavy import, only load it when it's actually needed
+    import httpx
+
+    host = urlsplit(url).netloc
+    await async_acquire_rate_limit(url)
+    if "timeout" not in kwargs:
+        connect, read = request_timeout()
+        kwargs["timeout"] = httpx.Timeout(read, connect=connect)
+    with recorder.span("http_request", host=host) as labels:
+        try:
+            r = await client.get(redirect_url(url), **kwargs)
+        except Exception:
+            labels["status"] = "exception"
+            raise
+        labels["status"] = r.status_code
+    recorder.increment("http_response_bytes_total", len(r.content), host=host)
+    return r
+
+
+def lookup_cache(url: str, cache_ttl: int | None, headers: dict) -> tuple:
+    """Look up url in the response cache
+
+    @param url: The requested URL
+    @param cache_ttl: Seconds a cached response is served without revalidation, None to bypass the cache
+    @param headers: Request headers, validators for revalidating a stale response are added
+    @return: Tuple of the cached entry (or None) and whether it's still fresh
+    """
+    if response_cache is None or cache_ttl is None:
+        return None, False
+    if (cached := response_cache.get(url)) is None:
+        return None, False
+    if cached.age < cache_ttl:
+        logger.debug(f"Serving {url} from cache.")
+        recorder.increment("http_cache_hits_total", host=urlsplit(url).netloc)
+        return cached, True
+    headers.update(cached.validators)
+    return cached, False
+
+
+def retry_delay(url: str, r, current_try: int, backoff_factor: float) -> float:
+    """Seconds to wait before retrying after the retryable response r
+
+    The backoff grows linearly with the tries and is jittered by 'backoff_jitter', a longer Retry-After of the
+    response is honoured.
+
+    @raise RetriesExhaustedError: If the Retry-After is longer than 'max_retry_after'
+    """
+    backoff_time = (
+        backoff_factor
+        * (current_try + 1)
+        * uniform(1 - backoff_jitter, 1 + backoff_jitter)
+    )
+    retry_after = parse_retry_after(r.headers.get("Retry-After"))
+    if retry_after is None:
+        return backoff_time
+    if retry_after > max_retry_after:
+        raise RetriesExhaustedError(url, r.status_code, current_try + 1)
+    return max(backoff_time, retry_after)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a Retry-After header, which is either in seconds or an HTTP date"""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def prepare_retry(url: str, status_code: int, current_try: int, backoff_time: float):
+    """Log and record a retry, unless the backoff doesn't fit into the current deadline anymore"""
+    logger.error(f"Got HTTP {status_code} on {current_try} try of {url}.")
+    if (time_left := deadline.remaining()) is not None and time_left < backoff_time:
+        raise DeadlineExceeded(
+            f"Not enough time left to retry {url} after {backoff_time}s."
+        )
+    host = urlsplit(url).netloc
+    recorder.increment("http_retries_total", host=host)
+    recorder.increment("http_backoff_seconds_total", backoff_time, host=host)
+
 
 def resilient_request(
-    url: str, retries: int = 3, backoff_factor: int = 5, additional_headers=None
+    url: str,
+    retries: int = 3,
+    backoff_factor: int = 5,
+    additional_headers=None,
+    cache_ttl: int | None = None,
+    profile: str = "default",
 ) -> Response:
-    """Do requests with retries on 5XX errors"""
-    if additional_headers is None:
-        additional_headers = {}
-    current_try = 0
-    backoff_time = backoff_factor
-    scraper = cloudscraper.CloudScraper(interpreter="py2js")
-    scraper.headers.update(additional_headers)
+    """Do requests with retries on retryable statuses (see 'retryable_status_codes')
+
+    If the response cache is enabled and a cache_ttl (in seconds) is given, responses younger than the
+    cache_ttl are served from the cache, older ones are revalidated via ETag/Last-Modified.
+    The request uses the shared session of the host and the scraper profile, see 'get_session'. Solved
+    Cloudflare challenges are stored if enabled, see 'configure_clearance'.
+    Hosts failing repeatedly aren't requested for a while, see 'CircuitBreaker'.
+
+    @raise RequestError: If there's no usable response, see its subclasses
+    @raise DeadlineExceeded: If there's no time left for the request or its retries
+    """
+    headers = dict(additional_headers or {})
+    cached, fresh = lookup_cache(url, cache_ttl, headers)
+    if fresh:
+        return cached.to_response()
+
+    scraper = get_session(url, profile=profile)
     # Manually implement retries as I couldn't get the "normal" requests version working with cloudscraper
-    while current_try <= retries:
-        r: Response = scraper.get(url)
-        if r.status_code == 200:
+    for current_try in range(retries + 1):
+        circuit_breaker.check(url)
+        try:
+            r: Response = scraper_get(scraper, url, profile, headers=headers)
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            record_request_exception(url)
+            raise
+        if (response := handle_response(url, r, cached, cache_ttl)) is not None:
+            return response
+        if current_try == retries:
             break
-        elif r.status_code <= 500 < 600:
-            logger.error(f"Got HTTP {r.status_code} on {current_try} try.")
-            sleep(backoff_time)
-            backoff_time += backoff_factor
-            current_try += 1
-            continue
-        else:
-            logger.critical(
-                f"Unexpected HTTP {r.status_code} on {current_try}. Exiting in panic!"
-            )
-            exit(1)
-    else:
-        logger.critical(
-            f"Could not get {url} afer {current_try} tries. Exiting sadly. :("
-        )
-        exit(1)
+        backoff_time = retry_delay(url, r, current_try, backoff_factor)
+        prepare_retry(url, r.status_code, current_try, backoff_time)
+        sleep(backoff_time)
+    # noinspection PyUnboundLocalVariable
+    raise RetriesExhaustedError(url, r.status_code, retries + 1)
+
+
+def record_request_exception(url: str) -> None:
+    """Count a request which raised as failure of its host, unless it was only cut short by the deadline"""
+    if (time_left := deadline.remaining()) is None or time_left > 0:
+        circuit_breaker.record_failure(url)
 
+
+def handle_response(url: str, r, cached, cache_ttl: int | None):
+    """Handle a response of 'resilient_request' or 'async_resilient_request'
+
+    @return: The response to return, None if the request should be retried
+    @raise StatusError: If the status isn't worth retrying
+    """
+    if r.status_code == 200:
+        circuit_breaker.record_success(url)
+        if response_cache is not None and cache_ttl is not None:
+            response_cache.put(url, r)
+        return r
+    if r.status_code == 304 and cached is not None:
+        circuit_breaker.record_success(url)
+        logger.debug(f"Revalidated cached {url}.")
+        recorder.increment("http_cache_revalidations_total", host=urlsplit(url).netloc)
+        response_cache.refresh(url)
+        return cached.to_response()
+    if r.status_code in circuit_failure_status_codes:
+        circuit_breaker.record_failure(url)
+    if r.status_code not in retryable_status_codes:
+        raise StatusError(url, r.status_code)
+    return None
+
+
+async def async_resilient_request(
+    url: str,
+    retries: int = 3,
+    backoff_factor: int = 5,
+    additional_headers=None,
+    cache_ttl: int | None = None,
+):
+    """Async variant of 'resilient_request' with the same retry and cache semantics
+
+    Uses the shared httpx.AsyncClients instead of cloudscraper, so it's only suited for hosts without
+    Cloudflare challenges. Backoff doesn't block the event loop.
+    """
+    headers = dict(additional_headers or {})
+    cached, fresh = lookup_cache(url, cache_ttl, headers)
+    if fresh:
+        return cached.to_response()
+
+    client = get_async_client(url)
+    for current_try in range(retries + 1):
+        circuit_breaker.check(url)
+        try:
+            r = await async_timed_get(client, url, headers=headers)
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            record_request_exception(url)
+            raise
+        if (response := handle_response(url, r, cached, cache_ttl)) is not None:
+            return response
+        if current_try == retries:
+            break
+        backoff_time = retry_delay(url, r, current_try, backoff_factor)
+        prepare_retry(url, r.status_code, current_try, backoff_time)
+        await asyncio.sleep(backoff_time)
     # noinspection PyUnboundLocalVariable
-    return r
+    raise RetriesExhaustedError(url, r.status_code, retries + 1)
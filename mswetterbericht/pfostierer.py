@@ -1,11 +1,68 @@
+from __future__ import annotations
+
+import sys
+
+from mswetterbericht.lib.profiling import ImportProfiler
+
+# Installed before any other import, so '--profile-startup' covers the whole cold start of the script
+import_profiler = (
+    ImportProfiler().install() if "--profile-startup" in sys.argv else None
+)
+
 import datetime
 import json
+import logging
 import re
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+from time import monotonic, sleep, time
+from typing import TYPE_CHECKING, Callable
+
+from mswetterbericht.lib.config import ConfigError, load_yaml
+from mswetterbericht.lib.metrics import recorder
+from wetterbericht import (
+    add_cache_arguments,
+    add_deadline_arguments,
+    add_history_arguments,
+    add_metrics_arguments,
+    add_scraper_arguments,
+    configure_cache,
+    configure_scraper,
+    configure_history,
+    default_refresh_interval,
+    load_config,
+    render_forecasts,
+    stream_forecast,
+    write_metrics,
+)
 
-import praw.models
+if TYPE_CHECKING:
+    import praw
+    import praw.models
 
-from wetterbericht import forecast
+logger = logging.getLogger(__name__)
+
+# Attempts for replying to the Daily Discussion Thread or editing the reply
+reply_retries = 4
+# Seconds to wait after a failed reply without a rate limit, multiplied by the attempt
+reply_backoff_factor = 10
+# Own comments checked for a reply which went through despite an error, see 'find_own_reply'
+own_comments_checked = 10
+# Seconds the clock of Reddit may be behind the local one when looking for a reply which went through
+max_clock_skew = 60
+# Seconds between two edits of a streamed reply, Reddit rate limits frequent edits
+min_edit_interval = 15
+# Instruments up to this priority have to be done before a streamed reply is posted, below the default priority of
+# the instruments file so only the most important ones are waited for
+default_stream_priority = 40
+# Oldest forecast of the daemon posted in seconds, the daemon is most likely stuck if it's older
+default_daemon_max_age = 3 * default_refresh_interval
+# Longest rate limit waited for before giving up
+max_ratelimit_wait = 15 * 60
+# Reddit tells how long to wait in its RATELIMIT message, e.g. "Take a break for 5 minutes before trying again."
+ratelimit_regex = re.compile(r"(\d+) (minute|second)")
 
 user_agent = "User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:103.0) Gecko/20100101 Firefox/103.0"
 bot_add_line = (
@@ -19,12 +76,239 @@ def parse_args() -> Namespace:
     parser.add_argument("--prose-file", required=True)
     parser.add_argument("--instruments-file", required=True)
     parser.add_argument("--credentials-file", required=True)
-    parser.add_argument("--subreddit", required=True)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--subreddit")
+    target.add_argument(
+        "--targets-file",
+        help="YAML file listing several subreddits to post to, each optionally with its own configuration, "
+        "see 'load_targets'",
+    )
+    add_cache_arguments(parser)
+    add_scraper_arguments(parser)
+    add_history_arguments(parser)
+    add_metrics_arguments(parser)
+    add_deadline_arguments(parser)
+    parser.add_argument(
+        "--daemon-url",
+        help="Get the forecast from a running 'wetterbericht serve' daemon ('http://host:port' or "
+        "'unix:///path/to/socket'), it's created locally if the daemon doesn't answer",
+    )
+    parser.add_argument(
+        "--daemon-max-age",
+        type=float,
+        default=default_daemon_max_age,
+        help="Oldest forecast of the daemon in seconds which is posted, older ones are created locally "
+        f"(default: {default_daemon_max_age})",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Reply as soon as the instruments up to --stream-priority are done and edit the remaining ones in as "
+        "they arrive. Ignored with --targets-file and --daemon-url.",
+    )
+    parser.add_argument(
+        "--stream-priority",
+        type=int,
+        default=default_stream_priority,
+        help=f"Highest priority the streamed reply waits for (default: {default_stream_priority})",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report the time spent per import after posting",
+    )
     args = parser.parse_args()
 
     return args
 
 
+def get_forecast(args: Namespace, config: tuple) -> str:
+    """Get the forecast from the daemon if configured, create it locally from config otherwise (see 'load_config')"""
+    if args.daemon_url:
+        from mswetterbericht.daemon import request_forecast
+
+        try:
+            with recorder.span("stage", stage="daemon_request"):
+                return request_forecast(args.daemon_url, max_age=args.daemon_max_age)
+        except Exception as e:
+            logger.error(
+                f"Could not get the forecast from the daemon, creating it locally. Error args: {e.args}"
+            )
+    return render_forecasts(
+        [config], deadline=args.deadline, weather_budget=args.weather_budget
+    )[0]
+
+
+def load_targets(args: Namespace) -> list:
+    """Load the targets file and the configuration of every target
+
+    Required YAML structure, 'instruments_file' and 'prose_file' default to the arguments and 'overlay' changes
+    single keys of the files (see 'lib.config.apply_overlay'):
+    targets:
+      - subreddit: mauerstrassenwetten
+      - subreddit: carbonarastrasse
+        prose_file: files/prose.yaml
+        overlay:
+          prose:
+            the_talk: ...
+
+    @return: List of tuples of the subreddit and its configuration (see 'load_config')
+    @raise ConfigError: If the targets file or the configuration of any target is invalid
+    """
+    with open(args.targets_file, "rb") as f:
+        content = load_yaml(f.read(), args.targets_file)
+    targets = content.get("targets") if isinstance(content, dict) else None
+    if not isinstance(targets, list) or not targets:
+        raise ConfigError(["targets: expected a non-empty list"])
+    problems = []
+    for i, target in enumerate(targets):
+        if not isinstance(target, dict) or not isinstance(target.get("subreddit"), str):
+            problems.append(f"targets[{i}]: expected a mapping with a 'subreddit'")
+    if problems:
+        raise ConfigError(problems)
+
+    loaded = []
+    for target in targets:
+        try:
+            config = load_config(
+                target.get("instruments_file", args.instruments_file),
+                target.get("prose_file", args.prose_file),
+                target.get("overlay"),
+            )
+        except ConfigError as e:
+            raise ConfigError(
+                [f"{target['subreddit']}: {problem}" for problem in e.problems]
+            )
+        loaded.append((target["subreddit"], config))
+    return loaded
+
+
+def get_forecasts(args: Namespace, targets: list | None, config: tuple | None) -> list:
+    """Get the forecast of every target, fetching every instrument only once, see 'load_targets'
+
+    Without targets, the forecast of config (the configuration of the arguments) is returned as single item, see
+    'get_forecast'.
+    """
+    if targets is None:
+        return [get_forecast(args, config)]
+    return render_forecasts(
+        [config for _, config in targets],
+        deadline=args.deadline,
+        weather_budget=args.weather_budget,
+    )
+
+
+def ratelimit_seconds(exception) -> int | None:
+    """Get the seconds to wait from a RATELIMIT error of Reddit, None if exception is no rate limit"""
+    for item in getattr(exception, "items", []):
+        if item.error_type != "RATELIMIT":
+            continue
+        if match := ratelimit_regex.search(item.message):
+            amount, unit = match.groups()
+            return int(amount) * (60 if unit == "minute" else 1)
+        return 60
+    return None
+
+
+def reply_with_retries(ddt: praw.models.Submission, body: str) -> praw.models.Comment:
+    """Reply to the ddt, waiting for rate limits and retrying temporary errors without recreating body
+
+    Replies aren't idempotent, so a reply which failed without a definite answer of Reddit is only retried if it
+    didn't go through anyway, see 'find_own_reply'.
+
+    @return: The reply
+    """
+    since = time() - max_clock_skew
+    return with_retries(
+        lambda: ddt.reply(body=body),
+        action="reply",
+        find_result=lambda: find_own_reply(ddt, since),
+    )
+
+
+def find_own_reply(
+    ddt: praw.models.Submission, since: float
+) -> praw.models.Comment | None:
+    """Find the latest comment of the logged in user in ddt created since the Unix timestamp since"""
+    for comment in ddt._reddit.user.me().comments.new(limit=own_comments_checked):
+        if comment.link_id == f"t3_{ddt.id}" and comment.created_utc >= since:
+            return comment
+    return None
+
+
+def edit_with_retries(comment: praw.models.Comment, body: str) -> None:
+    """Replace the body of comment, waiting for rate limits and retrying temporary errors"""
+    with_retries(lambda: comment.edit(body=body), action="edit")
+
+
+def with_retries(request: Callable, action: str, find_result: Callable | None = None):
+    """Call request, waiting for rate limits of Reddit and retrying temporary errors
+
+    @param request: Function sending the request to Reddit
+    @param action: Name of the request for the logs and the retry counter, e.g. 'reply'
+    @param find_result: Required for requests which aren't idempotent. Called before retrying a request which
+    failed without a definite answer of Reddit (e.g. a server error), it returns the result of the request if
+    it went through anyway and None otherwise.
+    @return: The return value of request
+    """
+    import prawcore
+    from praw.exceptions import RedditAPIException
+
+    # Whether the last attempt may have gone through despite its error
+    uncertain = False
+    for attempt in range(1, reply_retries + 1):
+        try:
+            if uncertain and find_result is not None:
+                if (result := find_result()) is not None:
+                    logger.warning(
+                        f"Request to {action} went through despite the error."
+                    )
+                    return result
+            uncertain = False
+            return request()
+        except RedditAPIException as e:
+            if (wait := ratelimit_seconds(e)) is None or wait > max_ratelimit_wait:
+                raise
+            # Reddit's wait times are rounded down
+            wait += 5
+        except prawcore.TooManyRequests as e:
+            wait = reply_backoff_factor * attempt
+            logger.error(f"Request to {action} failed with {e!r}.")
+        except (prawcore.ServerError, prawcore.RequestException) as e:
+            # Errors of find_result keep the previous request uncertain
+            uncertain = True
+            wait = reply_backoff_factor * attempt
+            logger.error(f"Request to {action} failed with {e!r}.")
+        if attempt == reply_retries:
+            raise RuntimeError(f"Could not {action} after {reply_retries} attempts.")
+        logger.warning(f"Waiting {wait}s before trying to {action} again.")
+        recorder.increment(f"reddit_{action}_retries_total")
+        sleep(wait)
+
+
+def locate_ddt(
+    creds: dict, target_sub: str, cache_dir: Path | None
+) -> praw.models.Submission:
+    """Log in and find todays Daily Discussion Thread, the thread ID is cached per day in cache_dir"""
+    # Heavy import, only load it when it's actually needed
+    import praw
+
+    reddit = praw.Reddit(**creds, check_for_updates=False, user_agent=user_agent)
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = cache_dir / f"{target_sub}-{datetime.date.today().isoformat()}"
+        if cache_path.exists():
+            logger.info("Using the cached ID of the Daily Discussion Thread.")
+            return reddit.submission(id=cache_path.read_text().strip())
+
+    with recorder.span("stage", stage="find_ddt"):
+        ddt = find_ddt(reddit, target_sub=target_sub)
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(ddt.id)
+    return ddt
+
+
 def find_ddt(reddit: praw.Reddit, target_sub: str) -> praw.models.Submission:
     # Format the search Regex for the Daily Discussion Thread
     ddt_date = datetime.date.today().strftime("%B %d, %Y")
@@ -39,11 +323,72 @@ def find_ddt(reddit: praw.Reddit, target_sub: str) -> praw.models.Submission:
         if re.search(ddt_date, submission.title):
             return submission
     else:
-        print("Could not find Daily Discussion Thread. 💩 Exiting.")
-        exit(1)
+        raise LookupError(
+            f"Could not find Daily Discussion Thread of r/{target_sub}. 💩"
+        )
+
+
+def post(ddt_future, body: str) -> None:
+    """Reply with body once the thread of ddt_future (see 'locate_ddt') was found"""
+    ddt = ddt_future.result()
+    with recorder.span("stage", stage="reddit_post"):
+        reply_with_retries(ddt, body)
+
+
+def post_streaming(ddt_future, progress_stream, priority: int) -> None:
+    """Reply with a partial forecast as soon as possible and edit in the remaining lines as they arrive
+
+    The reply is posted once all instruments up to priority are done (or the forecast is complete). Edits are
+    batched, there's at most one every 'min_edit_interval' seconds. The complete forecast is always edited in.
+
+    @param ddt_future: Future of the thread to reply to, see 'locate_ddt'
+    @param progress_stream: ForecastProgress generator, see 'wetterbericht.stream_forecast'
+    @param priority: Highest priority of the instruments the reply waits for
+    """
+    comment = None
+    posted_body = None
+    edited_at = 0.0
+    for progress in progress_stream:
+        body = progress.forecast + bot_add_line
+        if comment is None:
+            if not progress.complete and any(
+                pending <= priority for pending in progress.pending_priorities
+            ):
+                continue
+            ddt = ddt_future.result()
+            with recorder.span("stage", stage="reddit_post"):
+                comment = reply_with_retries(ddt, body)
+        else:
+            if body == posted_body:
+                continue
+            wait = min_edit_interval - (monotonic() - edited_at)
+            if wait > 0:
+                if not progress.complete:
+                    # Edited in with a later batch
+                    continue
+                sleep(wait)
+            with recorder.span("stage", stage="reddit_edit"):
+                edit_with_retries(comment, body)
+        posted_body = body
+        edited_at = monotonic()
 
 
 args = parse_args()
+configure_cache(args)
+configure_scraper(args)
+configure_history(args)
+
+# Fail before logging in and searching the thread if the configuration is broken
+targets = None
+config = None
+try:
+    if args.targets_file:
+        targets = load_targets(args)
+    else:
+        config = load_config(args.instruments_file, args.prose_file)
+except (ConfigError, OSError) as e:
+    print(f"Could not load the configuration: {e}")
+    exit(1)
 
 try:
     with open(args.credentials_file) as f:
@@ -62,10 +407,58 @@ except (IndexError, FileNotFoundError) as e:
     print("Could not load PRAW credentials file: %s" % e)
     exit(1)
 
-reddit = praw.Reddit(**creds, check_for_updates=False, user_agent=user_agent)
-
-ddt = find_ddt(reddit, target_sub=args.subreddit)
-ddt.reply(
-    body=forecast(instruments_file=args.instruments_file, prose_file=args.prose_file)
-    + bot_add_line
+subreddits = [args.subreddit] if targets is None else [sub for sub, _ in targets]
+# Logging in and finding the threads runs alongside the scraping for the forecasts, all targets are posted to
+# concurrently. Each target needs a thread for finding its thread and one for posting.
+executor = ThreadPoolExecutor(
+    max_workers=2 * len(subreddits), thread_name_prefix="reddit"
 )
+ddt_futures = [
+    executor.submit(
+        copy_context().run,
+        locate_ddt,
+        creds,
+        subreddit,
+        None if args.no_cache else Path(args.cache_dir) / "ddt",
+    )
+    for subreddit in subreddits
+]
+
+failed = []
+try:
+    if args.stream and targets is None and not args.daemon_url:
+        goethe, instruments_file_content = config
+        try:
+            post_streaming(
+                ddt_futures[0],
+                stream_forecast(
+                    goethe,
+                    instruments_file_content,
+                    deadline=args.deadline,
+                    weather_budget=args.weather_budget,
+                ),
+                args.stream_priority,
+            )
+        except Exception as e:
+            logger.error(f"Could not post to r/{args.subreddit}: {e!r}")
+            failed.append(args.subreddit)
+        bodies = []
+    else:
+        bodies = get_forecasts(args, targets, config)
+    post_futures = [
+        executor.submit(copy_context().run, post, ddt_future, body + bot_add_line)
+        for ddt_future, body in zip(ddt_futures, bodies)
+    ]
+    for subreddit, post_future in zip(subreddits, post_futures):
+        try:
+            post_future.result()
+        except Exception as e:
+            logger.error(f"Could not post to r/{subreddit}: {e!r}")
+            failed.append(subreddit)
+finally:
+    executor.shutdown(wait=False)
+    write_metrics(args)
+if import_profiler is not None:
+    print(import_profiler.report(), file=sys.stderr)
+if failed:
+    exit(1)
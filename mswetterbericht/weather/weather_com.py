@@ -1,7 +1,9 @@
 import re
+from functools import lru_cache
+from threading import Lock
+from time import monotonic
 
-from bs4 import BeautifulSoup
-
+from mswetterbericht.lib.parsing import parse_html
 from mswetterbericht.lib.web import resilient_request
 
 #####
@@ -13,12 +15,32 @@ from mswetterbericht.lib.web import resilient_request
 # Hardcode some stuff as the module should be self-contained
 # Hopefully there are not too many transformers
 location_url = "https://www.wetter.com/deutschland/dachsenhausen/DE0001902.html"
+# Used if the instruments file doesn't configure any 'weather.locations'
+default_locations = [{"name": "Dachsenhausen", "url": location_url}]
+# The forecast rows barely change during the day
+default_cache_ttl_hours = 3
+whitespace_regex = re.compile(r"\s+")
+# Only parse TDs which could be forecast rows
+forecast_td_class_regex = re.compile(r"(^|\s)portable-pb(\s|$)")
 transformers = {
     "nebel": "nebelig",
     "leichter_regen_und_windig": "leicht regnerisch und windig",
     "leichter_regenschauer_und_windig": "leicht schauerig und windig",
 }
 
+# Pretty forecasts per location URL and the time.monotonic they expire at, shared by all threads of the process
+forecast_cache = {}
+forecast_cache_lock = Lock()
+
+
+@lru_cache(maxsize=None)
+def compile_transformers(weather_transformers: tuple) -> dict:
+    """Key the transformers by their scraped wording (lower case with single spaces), so lookups need no conversion
+
+    @param weather_transformers: The items of the transformers dict
+    """
+    return {key.replace("_", " ").lower(): value for key, value in weather_transformers}
+
 
 def prettify_forecast(forecast: set, weather_transformers: dict) -> str:
     """
@@ -27,13 +49,13 @@ def prettify_forecast(forecast: set, weather_transformers: dict) -> str:
     @param weather_transformers: "Weather transformers" used to create a better wording for the forecast
     @return: Returns a (hopefully) nicely worded string for the weather forecast
     """
+    transformer_lookup = compile_transformers(tuple(weather_transformers.items()))
     pretty_forecast_set = set()
     for weather in forecast:
         # Remove all but one whitespace between words
-        weather = re.sub(r"\s+", " ", weather)
-        sanitised_weather = weather.replace(" ", "_").lower()
+        weather = whitespace_regex.sub(" ", weather)
         # Add transformed word if matches
-        if pretty_weather := weather_transformers.get(sanitised_weather):
+        if pretty_weather := transformer_lookup.get(weather.lower()):
             pretty_forecast_set.add(pretty_weather)
         else:
             pretty_forecast_set.add(weather)
@@ -43,14 +65,17 @@ def prettify_forecast(forecast: set, weather_transformers: dict) -> str:
     return pretty_forecast.replace(" und", ",", und_count - 1)
 
 
-def get_weather_forecast(location_url: str) -> set:
+def get_weather_forecast(
+    location_url: str, cache_ttl_hours: float = default_cache_ttl_hours
+) -> set:
     """
     Scrape the weather provider for the forecast
     @param location_url: Location URL where to scrape from
+    @param cache_ttl_hours: Hours the response is cached for
     @return: Returns a set of the noon and evening forceast
     """
-    r = resilient_request(location_url)
-    soup = BeautifulSoup(r.text, "html.parser")
+    r = resilient_request(location_url, cache_ttl=cache_ttl_hours * 60 * 60)
+    soup = parse_html(r.text, "td", class_=forecast_td_class_regex)
     # Not all TDs have the same class, therefore use 'select'
     mydivs = soup.select("td.text--center.delta.portable-pb")
 
@@ -58,10 +83,25 @@ def get_weather_forecast(location_url: str) -> set:
     return set(filter(None, [div_content.text.strip() for div_content in mydivs[1:3]]))
 
 
-def create_weather_forecast() -> tuple:
+def create_weather_forecast(
+    url: str = location_url, cache_ttl_hours: float = default_cache_ttl_hours
+) -> tuple:
     """
     Coordinating function for scraping and prettifying weather forecast results
+    @param url: Location URL where to scrape from
+    @param cache_ttl_hours: Hours the pretty forecast of the location is reused, 0 to always scrape
     @return: Returns a tuple with the first item being the pretty forecast string and the second being the scraped URL
     """
-    forecast = get_weather_forecast(location_url)
-    return prettify_forecast(forecast, transformers), location_url
+    with forecast_cache_lock:
+        cached = forecast_cache.get(url)
+    if cached is not None and cached[0] > monotonic():
+        return cached[1], url
+    forecast = get_weather_forecast(url, cache_ttl_hours)
+    pretty_forecast = prettify_forecast(forecast, transformers)
+    if cache_ttl_hours > 0:
+        with forecast_cache_lock:
+            forecast_cache[url] = (
+                monotonic() + cache_ttl_hours * 60 * 60,
+                pretty_forecast,
+            )
+    return pretty_forecast, url
@@ -1,11 +1,42 @@
+import sys
+
+from mswetterbericht.lib.profiling import ImportProfiler
+
+# Installed before any other import, so '--profile-startup' covers the whole cold start of the script
+import_profiler = (
+    ImportProfiler().install()
+    if __name__ == "__main__" and "--profile-startup" in sys.argv
+    else None
+)
+
+import asyncio
 import logging
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from datetime import datetime
 from importlib import import_module
+from inspect import iscoroutinefunction
+from pathlib import Path
+from queue import Queue
+from time import time
+from typing import Callable
 from random import choice as random_choice
 
 import attr
 from ruamel.yaml import YAML
 
+from mswetterbericht.lib import web
+from mswetterbericht.lib import deadline as deadline_module
+from mswetterbericht.lib.cache import ResponseCache, default_cache_dir
+from mswetterbericht.lib.config import ConfigError, apply_overlay, compile_config
+from mswetterbericht.lib.deadline import time_limit
+from mswetterbericht.lib.history import HistoryStore, PeriodChanges, default_history_dir
+from mswetterbericht.lib.last_known_good import LastKnownGoodStore
+from mswetterbericht.lib.metrics import recorder
+from mswetterbericht.lib.templates import RenderPlan, compile_template
+
 # Configure logger
 logging.basicConfig(
     format="%(asctime)s %(levelname)-8s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
@@ -16,6 +47,39 @@ logger.setLevel(logging.DEBUG)
 # Configure ruamel.yaml parser
 yaml = YAML(typ="safe")
 
+# Maximum amount of concurrent requests per data provider if the module doesn't define 'max_concurrency'
+default_max_concurrency = 4
+
+# Threads for data providers without native async support, the semaphores per data provider limit them further
+max_worker_threads = 32
+
+# Seconds to wait for an instrument before also trying its next alternative, unless 'hedge_delay' is configured
+default_hedge_delay = 2.0
+
+# Keys of an instrument which are specific to its data provider and not inherited by its alternatives
+source_specific_keys = ("symbol",)
+
+# Address the daemon listens on if no Unix socket is given
+default_listen_address = "127.0.0.1:8421"
+
+# Seconds between two forecasts of the daemon
+default_refresh_interval = 300
+
+# Values of instruments which couldn't be created, rendered with the error line
+error_value = -1337
+
+# Directory of compiled configuration files, enabled via 'configure_cache'
+config_cache_dir: Path | None = None
+
+# Optional store of the daily quotes, enabled via 'configure_history'
+history_store: HistoryStore | None = None
+
+# Optional store of the latest quote per instrument, enabled via 'configure_history'
+last_known_good_store: LastKnownGoodStore | None = None
+
+# Seconds a last known good quote may be shown with the stale line, older ones get the error line
+max_stale_age = 7 * 24 * 60 * 60
+
 
 @attr.define(kw_only=True)
 class ProseGenerator:
@@ -24,6 +88,18 @@ class ProseGenerator:
     properties: dict
     prefixes: dict
     the_talk: str
+    # Frame of the weekly summary, see 'weekly_summary'
+    the_weekly_talk: str | None = None
+    _talk_plan: RenderPlan = attr.field(init=False)
+    _weekly_talk_plan: RenderPlan | None = attr.field(init=False)
+
+    def __attrs_post_init__(self):
+        self._talk_plan = compile_template(self.the_talk)
+        self._weekly_talk_plan = (
+            compile_template(self.the_weekly_talk)
+            if self.the_weekly_talk is not None
+            else None
+        )
 
     @classmethod
     def from_prose_file(cls, prose_file: str):
@@ -34,12 +110,22 @@ class ProseGenerator:
         """
         with open(prose_file) as f:
             prose_dict = yaml.load(f)
+        return cls.from_prose_dict(prose_dict)
+
+    @classmethod
+    def from_prose_dict(cls, prose_dict: dict):
+        """Generate a class from the already loaded content of a prose file
+
+        @param prose_dict: Content of a prose file
+        @return: ProseGenerator object
+        """
         the_talk = prose_dict["the_talk"]
 
         return cls(
             properties=prose_dict["properties"],
             prefixes=prose_dict["prefixes"],
             the_talk=the_talk,
+            the_weekly_talk=prose_dict.get("the_weekly_talk"),
         )
 
     def choose_change_word(self, pct_change: float, instrument_type: str) -> str:
@@ -70,10 +156,13 @@ class ProseGenerator:
             raise e
 
     def talk_the_talk(self, prose_lines: list, weather_line: str) -> str:
-        return self.the_talk.format(
+        return self._talk_plan.render(
             prose_lines="\n".join(prose_lines), weather_line=weather_line
         )
 
+    def talk_the_weekly_talk(self, prose_lines: list) -> str:
+        return self._weekly_talk_plan.render(prose_lines="\n".join(prose_lines))
+
 
 @attr.define(kw_only=True)
 class InstrumentLine:
@@ -81,6 +170,15 @@ class InstrumentLine:
 
     line: str = attr.field(converter=lambda x: x.strip())
     plural: bool
+    # Compiled line with the verb already filled in
+    _plan: RenderPlan = attr.field(init=False)
+
+    def __attrs_post_init__(self):
+        self._plan = self.compile_line().bind(verb=self.verb)
+
+    def compile_line(self) -> RenderPlan:
+        """Compile the line into a RenderPlan, overridable for lines which aren't plain templates"""
+        return compile_template(self.line)
 
     @property
     def verb(self) -> str:
@@ -97,7 +195,8 @@ class InstrumentLine:
         @param kwargs: Remaining required arguments for the InstrumentLine
         @return: A properly filled and formatted instrument line
         """
-        return self.line.format(verb=self.verb, change_word=change_word, **kwargs)
+        kwargs["change_word"] = change_word
+        return self._plan.render_map(kwargs)
 
 
 @attr.define
@@ -138,6 +237,17 @@ class Instrument:
         """The intended way to create this class for child classes, has to create its own InstrumentLine object"""
         pass
 
+    @classmethod
+    async def async_from_instrument_data(cls, instrument_data):
+        """Asynchronous variant of 'from_instrument_data', which is what the forecast actually calls
+
+        Data providers with native async I/O can override this. By default 'from_instrument_data' runs in the
+        thread pool of the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, copy_context().run, cls.from_instrument_data, instrument_data
+        )
+
     @staticmethod
     def create_values(pct_change: float, absolute_value: float) -> InstrumentValues:
         """Create an InstrumentValues object
@@ -163,103 +273,1268 @@ class Instrument:
             url=self.url,
             pct_change=self.values.pretty_pct_change,
             absolute_value=self.values.pretty_absolute_value,
+            **self.extra_format_fields(),
         )
 
+    def extra_format_fields(self) -> dict:
+        """Additional fields for the line of this instrument, overridable by instruments with special lines"""
+        return {}
+
+
+@attr.define(kw_only=True)
+class SummaryInstrument(Instrument):
+    """Instrument of the weekly summary, its values are the weekly change and the latest stored quote"""
+
+    # Changes over all periods, see 'lib.history.HistoryStore.period_changes'
+    changes: PeriodChanges
+
+    @staticmethod
+    def pretty_change(pct_change: float | None) -> str:
+        if pct_change is None:
+            return "?"
+        return InstrumentValues(
+            pct_change=pct_change, absolute_value=0
+        ).pretty_pct_change
+
+    def extra_format_fields(self) -> dict:
+        return {
+            "month_change": self.pretty_change(self.changes.month),
+            "ytd_change": self.pretty_change(self.changes.ytd),
+            "volatility": self.pretty_change(self.changes.volatility).lstrip("+"),
+        }
+
+
+@attr.define(kw_only=True)
+class StaleInstrument(Instrument):
+    """Instrument which couldn't be fetched, its values are the last known good quote"""
+
+    # Unix timestamp the values were fetched at
+    fetched_at: float
+
+    def extra_format_fields(self) -> dict:
+        return {
+            "as_of": datetime.fromtimestamp(self.fetched_at).strftime("%d.%m. %H:%M")
+        }
+
+
+@attr.define(kw_only=True)
+class ForecastProgress:
+    """A forecast yielded by 'stream_forecast', possibly still missing instruments or the weather"""
+
+    forecast: str
+    # Priorities of the instruments which aren't done yet
+    pending_priorities: list
+    # Whether all instruments and the weather are done, the forecast is final then
+    complete: bool
+
+
+@attr.define(kw_only=True)
+class InstrumentSource:
+    """A data provider to fetch an instrument from, instruments can have several alternative sources"""
+
+    # Name of the data provider module
+    provider: str
+    provider_instrument: type
+    # Instrument data with defaults already applied
+    instrument_data: dict
+    # Limits the concurrent requests of the data provider, shared by all its sources
+    semaphore: asyncio.Semaphore
+    # Module level 'prefetch' function of the data provider, if any
+    prefetch: Callable | None = None
+
 
 def parse_args() -> Namespace:
     parser = ArgumentParser()
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=("forecast", "serve", "weekly"),
+        default="forecast",
+        help="Print a single forecast, run a daemon serving forecasts over HTTP or print the weekly summary of "
+        "the stored quotes",
+    )
     parser.add_argument("--prose-file", required=True)
     parser.add_argument("--instruments-file", required=True)
+    add_daemon_arguments(parser)
+    add_cache_arguments(parser)
+    add_scraper_arguments(parser)
+    add_history_arguments(parser)
+    add_metrics_arguments(parser)
+    add_deadline_arguments(parser)
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report the time spent per import after running",
+    )
     return parser.parse_args()
 
 
-def create_instruments(instruments_data: dict) -> list:
-    """Create ProviderInstrument objects by dynamically importing the provider module (key of instruments_data)"""
+def add_cache_arguments(parser: ArgumentParser) -> None:
+    """Add the arguments for the persistent response cache, see 'configure_cache'"""
+    parser.add_argument("--cache-dir", default=default_cache_dir)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the response cache and don't store solved Cloudflare challenges",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="Remove all cached responses before running",
+    )
+
+
+def add_scraper_arguments(parser: ArgumentParser) -> None:
+    """Add the arguments for the scraper sessions, see 'configure_scraper'"""
+    parser.add_argument(
+        "--js-interpreter",
+        help="Interpreter for Cloudflare's JavaScript challenges, e.g. 'nodejs', 'v8' or 'js2py'. By default "
+        "the first installed one of these is used.",
+    )
+
+
+def add_daemon_arguments(parser: ArgumentParser) -> None:
+    """Add the arguments of the 'serve' command, see 'daemon.serve'"""
+    parser.add_argument(
+        "--listen",
+        default=default_listen_address,
+        help="Address ('host:port') the daemon listens on",
+    )
+    parser.add_argument(
+        "--socket", help="Unix socket the daemon listens on instead of --listen"
+    )
+    parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=default_refresh_interval,
+        help="Seconds between two forecasts of the daemon",
+    )
+
+
+def add_deadline_arguments(parser: ArgumentParser) -> None:
+    """Add the arguments for the 'deadline' and 'weather_budget' of 'forecast'"""
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Seconds until the forecast has to be finished, late instruments get the error line",
+    )
+    parser.add_argument(
+        "--weather-budget",
+        type=float,
+        help="Seconds the weather may take at most, it's scraped alongside the instruments",
+    )
+
+
+def add_metrics_arguments(parser: ArgumentParser) -> None:
+    """Add the arguments for writing the recorded metrics, see 'write_metrics'"""
+    parser.add_argument(
+        "--trace-file", help="Write a JSON trace of the run to this file"
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        help="Write metrics of the run to this file for the Prometheus node exporter",
+    )
+
+
+def write_metrics(args: Namespace) -> None:
+    """Write the recorded metrics according to the arguments of 'add_metrics_arguments'"""
+    if args.trace_file:
+        recorder.write_json_trace(args.trace_file)
+    if args.metrics_textfile:
+        recorder.write_prometheus_textfile(args.metrics_textfile)
+
+
+def configure_cache(args: Namespace) -> None:
+    """Enable the response and config caches according to the arguments of 'add_cache_arguments'"""
+    global config_cache_dir
+    if args.clear_cache:
+        ResponseCache(directory=args.cache_dir).clear()
+    if not args.no_cache:
+        web.configure_cache(args.cache_dir)
+        web.configure_clearance(args.cache_dir)
+        config_cache_dir = Path(args.cache_dir) / "config"
+
+
+def configure_scraper(args: Namespace) -> None:
+    """Configure the scraper sessions according to the arguments of 'add_scraper_arguments'"""
+    web.configure_interpreter(args.js_interpreter)
+
+
+def add_history_arguments(parser: ArgumentParser) -> None:
+    """Add the arguments for the stores of daily and last known good quotes, see 'configure_history'"""
+    parser.add_argument("--history-dir", default=default_history_dir)
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Don't store the quotes of the run and don't fall back to the last known good ones",
+    )
+
+
+def configure_history(args: Namespace) -> None:
+    """Enable the stores of daily and last known good quotes according to the arguments of 'add_history_arguments'"""
+    global history_store
+    if not args.no_history:
+        history_store = HistoryStore(directory=args.history_dir)
+    configure_last_known_good(args)
+
+
+def configure_last_known_good(args: Namespace) -> None:
+    """Enable the store of last known good quotes according to the arguments of 'add_history_arguments'"""
+    global last_known_good_store
+    if not args.no_history:
+        last_known_good_store = LastKnownGoodStore(
+            path=Path(args.history_dir) / "last_known_good.sqlite"
+        )
+
+
+def is_fetched(instrument: Instrument) -> bool:
+    """Whether the values of instrument were fetched in this run, rather than an error or a stale instrument"""
+    return instrument.values.absolute_value != error_value and not isinstance(
+        instrument, StaleInstrument
+    )
+
+
+def quote_key(data_provider: str, instrument_data: dict) -> str:
+    """Key of an instrument in the LastKnownGoodStore"""
+    return f"{data_provider}:{instrument_data.get('symbol', instrument_data['url'])}"
+
+
+def record_last_known_good(instruments: dict) -> None:
+    """Store the values of all fetched instruments as their last known good quote, errors only get logged
+
+    @param instruments: Dict mapping the keys of 'quote_key' to the instruments
+    """
+    quotes = {
+        key: instrument.values
+        for key, instrument in instruments.items()
+        if is_fetched(instrument)
+    }
+    # noinspection PyBroadException
+    try:
+        last_known_good_store.put_many(quotes)
+    except Exception as e:
+        logger.error(
+            f"Could not store the last known good quotes. Error args: {e.args}"
+        )
+
+
+def record_history(
+    instruments: dict, instruments_data: dict, store: HistoryStore
+) -> None:
+    """Store the quotes of all successfully created instruments in store, errors only get logged
+
+    The quotes are stored by the keys of 'quote_key', so renaming an instrument in the instruments file keeps its
+    history.
+
+    @param instruments: Instruments of 'async_create_instrument_map'
+    @param instruments_data: Content of the instruments file the instruments were created from
+    @param store: Store for the quotes
+    """
     defaults = instruments_data.get("defaults", {})
-    instruments = []
-    for data_provider, instruments_list in instruments_data["instruments"].items():
+    for (data_provider, position), instrument in instruments.items():
+        if not is_fetched(instrument):
+            continue
+        instrument_data = {
+            **defaults,
+            **instruments_data["instruments"][data_provider][position],
+        }
+        # noinspection PyBroadException
         try:
-            mod = import_module(f"mswetterbericht.data_providers.{data_provider}")
-            provider_instrument = getattr(mod, "ProviderInstrument")
-            for instrument in instruments_list:
-                # Add defaults if keys don't exist
-                complete_instrument = defaults.copy()
-                complete_instrument.update(instrument)
-
-                # We may need this twice
-                plural = complete_instrument.pop("plural")
-                # noinspection PyBroadException
-                try:
-                    # Putting the creation here instead of in the modules enables internal changes without needing to
-                    # change each module
-
-                    complete_instrument["line"] = provider_instrument.create_line(
-                        plural=plural,
-                        line=instruments_data["lines"]["instruments"][
-                            complete_instrument["type"]
-                        ],
-                    )
-                    instruments.append(
-                        provider_instrument.from_instrument_data(complete_instrument)
-                    )
+            store.append(
+                quote_key(data_provider, instrument_data),
+                instrument.values.absolute_value,
+            )
+        except Exception as e:
+            logger.error(
+                f"Could not store the quote of '{instrument.description}'. Error args: {e.args}"
+            )
+
+
+def create_error_instrument(
+    complete_instrument: dict, plural: bool, error_line: str
+) -> Instrument:
+    """Create a "fake" instrument which only contains the most important details for the error line"""
+    return Instrument(
+        description=complete_instrument["description"],
+        url=complete_instrument["url"],
+        type=complete_instrument["type"],
+        priority=complete_instrument["priority"],
+        values=InstrumentValues(pct_change=error_value, absolute_value=error_value),
+        # The error line is always a plain string, even if the provider uses special lines otherwise
+        line=Instrument.create_line(plural=plural, line=error_line),
+    )
+
+
+def create_fallback_instrument(source: "InstrumentSource", lines: dict) -> Instrument:
+    """Create the instrument shown if source couldn't be fetched
+
+    That's the last known good quote with the 'stale' line, if the instruments file has one and the quote isn't
+    older than 'max_stale_age'. Otherwise it's the error line. The next run fetches the instrument again.
+    """
+    instrument_data = source.instrument_data.copy()
+    plural = instrument_data.pop("plural")
+    quote = None
+    if last_known_good_store is not None and lines.get("stale") is not None:
+        # noinspection PyBroadException
+        try:
+            quote = last_known_good_store.get(
+                quote_key(source.provider, instrument_data)
+            )
+        except Exception as e:
+            logger.error(
+                f"Could not look up the last known good quote. Error args: {e.args}"
+            )
+    if quote is None or time() - quote.fetched_at > max_stale_age:
+        return create_error_instrument(instrument_data, plural, lines["error"])
+    logger.warning(
+        f"Showing the last known good quote of '{instrument_data['description']}'."
+    )
+    recorder.increment("instrument_stale_total", provider=source.provider)
+    return StaleInstrument(
+        description=instrument_data["description"],
+        url=instrument_data["url"],
+        type=instrument_data["type"],
+        priority=instrument_data["priority"],
+        # Rendered like the fetched values of the data provider, e.g. with its currency
+        values=source.provider_instrument.create_values(
+            pct_change=quote.pct_change, absolute_value=quote.absolute_value
+        ),
+        line=Instrument.create_line(plural=plural, line=lines["stale"]),
+        fetched_at=quote.fetched_at,
+    )
 
-                # Yep, the exception being that broad is intentional
-                except Exception as e:
-                    logger.error(
-                        f"Encountered error for "
-                        f"'{complete_instrument.get('description', 'unknown instrument')}'. Error args: {e.args}"
+
+async def run_prefetch(prefetch, instruments: list) -> None:
+    """Run the 'prefetch' function of a data provider module, errors only get logged
+
+    'prefetch' may be a coroutine function, otherwise it runs in the thread pool of the event loop.
+    Instruments fall back to fetching their values individually if the prefetch failed.
+    """
+    # noinspection PyBroadException
+    try:
+        with recorder.span("prefetch", provider=prefetch.__module__.rsplit(".", 1)[-1]):
+            if iscoroutinefunction(prefetch):
+                await prefetch(instruments)
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, copy_context().run, prefetch, instruments
+                )
+    except Exception as e:
+        logger.error(
+            f"Prefetching {len(instruments)} instruments via '{prefetch.__module__}' failed. Error args: {e.args}"
+        )
+
+
+async def create_instrument(
+    source: "InstrumentSource", lines: dict, prefetched: asyncio.Task | None = None
+) -> Instrument:
+    """Create a single ProviderInstrument from one source, errors are logged and raised
+
+    @param source: The data provider and instrument data to use
+    @param lines: The 'lines' section of the instruments file
+    @param prefetched: Task of the data providers prefetch which has to finish before fetching
+    @return: The ProviderInstrument
+    """
+    if prefetched is not None:
+        # Unlike awaiting the task directly, this doesn't cancel the shared prefetch if this instrument is cancelled
+        await asyncio.wait([prefetched])
+    # Don't modify the sources instrument data, it's required for the error line on timeouts
+    instrument_data = source.instrument_data.copy()
+    plural = instrument_data.pop("plural")
+    with recorder.span(
+        "instrument",
+        provider=source.provider,
+        instrument=instrument_data.get("description", "unknown instrument"),
+    ) as labels:
+        try:
+            # Putting the creation here instead of in the modules enables internal changes without needing to
+            # change each module
+            instrument_data["line"] = source.provider_instrument.create_line(
+                plural=plural, line=lines["instruments"][instrument_data["type"]]
+            )
+            async with source.semaphore:
+                instrument = (
+                    await source.provider_instrument.async_from_instrument_data(
+                        instrument_data
                     )
-                    # Use the error line for faulty instruments
-                    complete_instrument["line"] = provider_instrument.create_line(
-                        plural=plural, line=instruments_data["lines"]["error"]
+                )
+        except asyncio.CancelledError:
+            labels["outcome"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(
+                f"Encountered error for "
+                f"'{instrument_data.get('description', 'unknown instrument')}' via '{source.provider}'. "
+                f"Error args: {e.args}"
+            )
+            labels["outcome"] = "error"
+            raise
+        labels["outcome"] = "ok"
+        return instrument
+
+
+async def fetch_instrument(
+    sources: list, lines: dict, hedge_delay: float, prefetch_tasks: dict
+) -> Instrument:
+    """Create an instrument from the first of its sources answering, see 'create_fallback_instrument' otherwise
+
+    The sources are started in order. The next source is started as soon as the running ones failed or
+    haven't answered within hedge_delay seconds, then the first valid answer wins and the others get cancelled.
+
+    @param sources: InstrumentSources of the instrument, in order of preference
+    @param lines: The 'lines' section of the instruments file
+    @param hedge_delay: Seconds to wait for the running sources before starting the next one
+    @param prefetch_tasks: Prefetch tasks per prefetch function, only used for the first source
+    @return: The ProviderInstrument or the fallback Instrument
+    """
+    waiting = list(sources)
+    running = set()
+    try:
+        while waiting or running:
+            if waiting:
+                source = waiting.pop(0)
+                if source is not sources[0]:
+                    reason = "failover" if not running else "hedge"
+                    logger.info(
+                        f"Trying '{source.provider}' for "
+                        f"'{source.instrument_data.get('description', 'unknown instrument')}' ({reason})."
                     )
-                    # Create a "fake" instrument which only contains the most important details for the error line
-                    instruments.append(
-                        Instrument(
-                            description=complete_instrument["description"],
-                            url=complete_instrument["url"],
-                            type=complete_instrument["type"],
-                            priority=complete_instrument["priority"],
-                            values=InstrumentValues(
-                                pct_change=-1337, absolute_value=-1337
-                            ),
-                            line=complete_instrument["line"],
-                        )
+                    recorder.increment(
+                        "instrument_alternatives_total",
+                        provider=source.provider,
+                        reason=reason,
                     )
+                    prefetched = None
+                else:
+                    prefetched = prefetch_tasks.get(source.prefetch)
+                running.add(
+                    asyncio.create_task(create_instrument(source, lines, prefetched))
+                )
+            # Only the last source may take as long as it needs
+            done, running = await asyncio.wait(
+                running,
+                timeout=hedge_delay if waiting else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+    finally:
+        for task in running:
+            task.cancel()
 
-        except (ModuleNotFoundError, AttributeError) as e:
-            logger.error(
-                f"Skipping instruments of Data Provider '{data_provider}. Error was: '{e}'"
+    return create_fallback_instrument(sources[0], lines)
+
+
+def notify_done(callback: Callable, *args) -> None:
+    """Done callback for 'functools.partial', calls callback with the bound args and the result of the task
+
+    The task is the last of args, nothing is called if it was cancelled or failed.
+    """
+    *bound_args, task = args
+    if not task.cancelled() and task.exception() is None:
+        callback(*bound_args, task.result())
+
+
+def run_async(coroutine):
+    """Run coroutine in a new event loop, usable from synchronous code
+
+    Unlike 'asyncio.run' this doesn't wait for the threads of the loop to finish. Data providers without native
+    async support may still be blocked in them after a deadline expired, their requests time out on their own.
+    """
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(
+        max_workers=max_worker_threads, thread_name_prefix="instrument"
+    )
+    loop.set_default_executor(executor)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(web.close_async_clients())
+        executor.shutdown(wait=False, cancel_futures=True)
+        loop.close()
+
+
+def create_instruments(instruments_data: dict) -> list:
+    """Synchronous wrapper of 'async_create_instruments'"""
+    return run_async(async_create_instruments(instruments_data))
+
+
+async def async_create_instruments(instruments_data: dict) -> list:
+    """Create ProviderInstrument objects in the order of the instruments file, see 'async_create_instrument_map'"""
+    return list((await async_create_instrument_map(instruments_data)).values())
+
+
+async def async_create_instrument_map(
+    instruments_data: dict,
+    on_created: Callable | None = None,
+    on_skipped: Callable | None = None,
+) -> dict:
+    """Create ProviderInstrument objects by dynamically importing the provider module (key of instruments_data)
+
+    All instruments are fetched concurrently on the running event loop, each data provider module can limit
+    its amount of concurrent requests via a module level 'max_concurrency'. The returned list keeps the order of
+    the instruments file. Data providers create their instruments via 'Instrument.async_from_instrument_data',
+    which only needs to be overridden for native async I/O.
+
+    Instruments can list 'alternatives', other data providers (with their own 'symbol' and optionally 'url')
+    to try in order if the instrument failed or didn't answer within the top level 'hedge_delay', see
+    'fetch_instrument'.
+
+    Data provider modules able to fetch several instruments at once can define a module level
+    'prefetch(instruments: list)' function or coroutine function. It's called once with the instruments of all
+    data providers sharing that function before these instruments are created.
+
+    Data provider modules are only imported if they have instruments. Modules requiring some setup before
+    creating instruments (e.g. monkey patching a library) can do so in a module level 'init()' function.
+
+    If a deadline is running (see 'lib.deadline.time_limit'), instruments not created until the deadline
+    expires are rendered like failed ones, see 'create_fallback_instrument'. The values of all fetched instruments
+    are stored as their last known good quote.
+
+    @param instruments_data: Content of the instruments file
+    @param on_created: Called on the event loop with the key and the instrument as soon as an instrument is done
+    @param on_skipped: Called with the key of every instrument left out because of a faulty data provider module
+    @return: Dict mapping a tuple of the data provider and the position in its list to the created instrument,
+    ordered like the instruments file. Instruments of faulty data provider modules are left out.
+    """
+    defaults = instruments_data.get("defaults", {})
+    hedge_delay = instruments_data.get("hedge_delay", default_hedge_delay)
+    # Imported data provider modules and their semaphore, None if the module is faulty
+    providers = {}
+
+    def create_source(data_provider: str, instrument_data: dict):
+        if data_provider not in providers:
+            try:
+                mod = import_module(f"mswetterbericht.data_providers.{data_provider}")
+                provider_instrument = getattr(mod, "ProviderInstrument")
+                if init := getattr(mod, "init", None):
+                    init()
+            except (ModuleNotFoundError, AttributeError) as e:
+                logger.error(
+                    f"Skipping instruments of Data Provider '{data_provider}. Error was: '{e}'"
+                )
+                providers[data_provider] = None
+            else:
+                semaphore = asyncio.Semaphore(
+                    getattr(mod, "max_concurrency", default_max_concurrency)
+                )
+                providers[data_provider] = (mod, provider_instrument, semaphore)
+        if providers[data_provider] is None:
+            return None
+        mod, provider_instrument, semaphore = providers[data_provider]
+        return InstrumentSource(
+            provider=data_provider,
+            provider_instrument=provider_instrument,
+            instrument_data=instrument_data,
+            semaphore=semaphore,
+            prefetch=getattr(mod, "prefetch", None),
+        )
+
+    # Sources per instrument, the first one is the primary source
+    jobs = []
+    # Data provider and position of the instrument of every job
+    job_keys = []
+    # Instruments per prefetch function, data providers may share the same function
+    prefetch_instruments = {}
+    for data_provider, instruments_list in instruments_data["instruments"].items():
+        for position, instrument in enumerate(instruments_list or []):
+            # Add defaults if keys don't exist
+            complete_instrument = defaults.copy()
+            complete_instrument.update(instrument)
+            alternatives = complete_instrument.pop("alternatives", None) or []
+            if (primary := create_source(data_provider, complete_instrument)) is None:
+                if on_skipped is not None:
+                    on_skipped((data_provider, position))
+                continue
+            sources = [primary]
+            for alternative in alternatives:
+                alternative_data = {
+                    key: value
+                    for key, value in complete_instrument.items()
+                    if key not in source_specific_keys
+                }
+                alternative_data.update(alternative)
+                if source := create_source(
+                    alternative_data.pop("provider"), alternative_data
+                ):
+                    sources.append(source)
+            jobs.append(sources)
+            job_keys.append((data_provider, position))
+            # Alternatives are only fetched on demand, so they aren't prefetched
+            if primary.prefetch is not None:
+                prefetch_instruments.setdefault(primary.prefetch, []).append(
+                    complete_instrument
+                )
+
+    if not jobs:
+        return {}
+
+    # Tasks get a copy of the current context, so the deadline applies within them as well
+    prefetch_tasks = {
+        prefetch: asyncio.create_task(run_prefetch(prefetch, instruments))
+        for prefetch, instruments in prefetch_instruments.items()
+    }
+    tasks = [
+        asyncio.create_task(
+            fetch_instrument(
+                sources, instruments_data["lines"], hedge_delay, prefetch_tasks
             )
-            continue
+        )
+        for sources in jobs
+    ]
+    if on_created is not None:
+        for key, task in zip(job_keys, tasks):
+            task.add_done_callback(partial(notify_done, on_created, key))
+    done, pending = await asyncio.wait(tasks, timeout=deadline_module.remaining())
+    for task in [*pending, *prefetch_tasks.values()]:
+        task.cancel()
+    # Let the cancelled tasks finish their spans before the loop is gone
+    await asyncio.gather(*pending, *prefetch_tasks.values(), return_exceptions=True)
 
+    instruments = {}
+    for key, sources, task in zip(job_keys, jobs, tasks):
+        if task in done:
+            instruments[key] = task.result()
+            continue
+        primary = sources[0]
+        logger.error(
+            f"'{primary.instrument_data.get('description', 'unknown instrument')}' wasn't created before the deadline."
+        )
+        recorder.increment(
+            "instrument_deadline_exceeded_total", provider=primary.provider
+        )
+        instruments[key] = create_fallback_instrument(
+            primary, instruments_data["lines"]
+        )
+    if last_known_good_store is not None:
+        record_last_known_good(
+            {
+                quote_key(sources[0].provider, sources[0].instrument_data): instruments[
+                    key
+                ]
+                for key, sources in zip(job_keys, jobs)
+            }
+        )
     return instruments
 
 
-def create_weather_line(prose_line: str) -> str:
-    """Get weather forecast and fill prose_line with it"""
+def create_weather_line(prose_line: str, error_line: str | None = None) -> str:
+    """Get the weather forecast of the default location and fill prose_line with it
+
+    @param prose_line: Template for the weather line
+    @param error_line: Template used if the forecast couldn't be scraped, errors are raised if omitted
+    @return: The formatted weather line
+    """
     # Weather is hard coded for now
     from mswetterbericht.weather import weather_com
 
-    forecast, url = weather_com.create_weather_forecast()
-    return prose_line.format(url=url, forecast=forecast)
+    # noinspection PyBroadException
+    try:
+        weather = {weather_com.location_url: weather_com.create_weather_forecast()}
+    except Exception as e:
+        if error_line is None:
+            raise
+        logger.error(f"Encountered error for the weather. Error args: {e.args}")
+        weather = {}
+    return render_weather_lines(
+        {"weather": prose_line, "error": error_line},
+        weather_com.default_locations,
+        weather,
+    )
 
 
-def forecast(instruments_file: str, prose_file: str):
-    goethe = ProseGenerator.from_prose_file(prose_file)
-    with open(instruments_file) as f:
-        instruments_file_content = yaml.load(f)
-    # Create instruments and sort by instrument priority
-    instruments = sorted(
-        create_instruments(instruments_file_content), key=lambda inst: inst.priority
+def weather_config(instruments_file_content: dict) -> tuple:
+    """Get the optional 'weather' section of the instruments file
+
+    @return: Tuple of the locations (mappings of 'name' and 'url') and the hours their forecasts are cached
+    """
+    from mswetterbericht.weather import weather_com
+
+    weather = instruments_file_content.get("weather") or {}
+    locations = weather.get("locations")
+    return (
+        weather_com.default_locations if locations is None else locations,
+        weather.get("cache_ttl_hours", weather_com.default_cache_ttl_hours),
     )
-    weather_template = instruments_file_content["lines"]["weather"]
 
-    prose_lines = [instrument.generate_prose_line(goethe) for instrument in instruments]
-    weather_line = create_weather_line(weather_template)
-    return goethe.talk_the_talk(prose_lines, weather_line)
+
+async def async_fetch_weather(locations: list, cache_ttl_hours: float) -> dict:
+    """Scrape the forecasts of all locations concurrently in the thread pool of the event loop
+
+    @param locations: Locations of 'weather_config', each distinct URL is scraped once
+    @param cache_ttl_hours: Hours the forecasts are cached, see 'weather_com.create_weather_forecast'
+    @return: Dict mapping the location URLs to tuples of the forecast and its URL, None for locations which
+    failed or weren't scraped before the deadline expired
+    """
+    # Weather is hard coded for now
+    from mswetterbericht.weather import weather_com
+
+    urls = list(dict.fromkeys(location["url"] for location in locations))
+    if not urls:
+        return {}
+    loop = asyncio.get_running_loop()
+    with recorder.span("stage", stage="weather"):
+        futures = [
+            loop.run_in_executor(
+                None,
+                copy_context().run,
+                weather_com.create_weather_forecast,
+                url,
+                cache_ttl_hours,
+            )
+            for url in urls
+        ]
+        done, pending = await asyncio.wait(futures, timeout=deadline_module.remaining())
+    weather = {}
+    for url, future in zip(urls, futures):
+        weather[url] = None
+        if future not in done:
+            future.cancel()
+            logger.error(f"The weather of {url} wasn't scraped before the deadline.")
+        elif (e := future.exception()) is not None:
+            logger.error(
+                f"Encountered error for the weather of {url}. Error args: {e.args}"
+            )
+        else:
+            weather[url] = future.result()
+    return weather
+
+
+async def async_create_snapshot(
+    instruments_data: dict,
+    locations: list,
+    cache_ttl_hours: float,
+    weather_budget: float | None = None,
+    on_created: Callable | None = None,
+    on_skipped: Callable | None = None,
+    on_weather: Callable | None = None,
+) -> tuple:
+    """Create the instruments and scrape the weather concurrently
+
+    @param instruments_data: Content of the instruments file, see 'async_create_instrument_map'. Its
+    'rate_limits' apply to all requests, see 'lib.web.configure_rate_limits'.
+    @param locations: Weather locations, see 'async_fetch_weather'
+    @param cache_ttl_hours: Hours the forecasts are cached
+    @param weather_budget: Seconds the weather may take at most, the running deadline applies as well
+    @param on_created: Called as soon as an instrument is done, see 'async_create_instrument_map'
+    @param on_skipped: Called for instruments of faulty data providers, see 'async_create_instrument_map'
+    @param on_weather: Called with the weather as soon as it's done
+    @return: Tuple of the instruments of 'async_create_instrument_map' and the weather of 'async_fetch_weather'
+    """
+    web.configure_rate_limits(instruments_data.get("rate_limits") or {})
+    with time_limit(weather_budget):
+        # The task gets a copy of the context, so the weather budget only applies within it
+        weather_task = asyncio.create_task(
+            async_fetch_weather(locations, cache_ttl_hours)
+        )
+    if on_weather is not None:
+        weather_task.add_done_callback(partial(notify_done, on_weather))
+    with recorder.span("stage", stage="instruments"):
+        instruments = await async_create_instrument_map(
+            instruments_data, on_created, on_skipped
+        )
+    return instruments, await weather_task
+
+
+def render_weather_lines(lines: dict, locations: list, weather: dict) -> str:
+    """Render the weather line of every location, locations without a forecast get the error line
+
+    @param lines: The 'lines' section of the instruments file
+    @param locations: Locations of 'weather_config'
+    @param weather: Forecasts per location URL, see 'async_fetch_weather'
+    @return: The weather lines of all locations
+    """
+    weather_lines = []
+    for location in locations:
+        if (location_weather := weather.get(location["url"])) is None:
+            weather_lines.append(
+                compile_template(lines["error"]).render(
+                    description=f"Das Wetter in {location['name']}",
+                    url=location["url"],
+                    verb="ist",
+                )
+            )
+            continue
+        forecast, url = location_weather
+        weather_lines.append(
+            compile_template(lines["weather"]).render(
+                location=location["name"], url=url, forecast=forecast
+            )
+        )
+    return "\n".join(weather_lines)
+
+
+def compile_lines(lines: dict) -> None:
+    """Compile all plain templates of the 'lines' section up front, so they're only parsed once
+
+    Broken templates fail right away instead of after all instruments were fetched. Special lines (like the
+    upside-down lists) are compiled by their data provider when they're used first.
+    """
+    instrument_lines = [
+        lines.get("error"),
+        lines.get("weekly"),
+        lines.get("stale"),
+        *lines.get("instruments", {}).values(),
+    ]
+    for template in instrument_lines:
+        if isinstance(template, str):
+            # InstrumentLines strip their line
+            compile_template(template.strip())
+    if isinstance(weather_line := lines.get("weather"), str):
+        compile_template(weather_line)
+
+
+def load_config(
+    instruments_file: str, prose_file: str, overlay: dict | None = None
+) -> tuple:
+    """Load and validate the configuration files of the forecast, see 'lib.config.compile_config'
+
+    @param instruments_file: YAML file with the instruments and lines
+    @param prose_file: YAML file with prose words
+    @param overlay: Changes to the files, see 'lib.config.apply_overlay'
+    @return: Tuple of the ProseGenerator and the content of the instruments file with the defaults applied
+    @raise ConfigError: If any of the files is invalid
+    """
+    with recorder.span("stage", stage="config_load"):
+        config = compile_config(instruments_file, prose_file, config_cache_dir)
+        if overlay:
+            config = apply_overlay(config, overlay)
+        goethe = ProseGenerator.from_prose_dict(config.prose)
+        instruments_file_content = config.instruments
+        compile_lines(instruments_file_content["lines"])
+    return goethe, instruments_file_content
+
+
+def render_forecast(
+    goethe: ProseGenerator,
+    instruments_file_content: dict,
+    deadline: float | None = None,
+    weather_budget: float | None = None,
+    history: HistoryStore | None = None,
+) -> str:
+    """Create the complete forecast from already loaded configuration files, see 'load_config'
+
+    @param goethe: ProseGenerator for the prose lines
+    @param instruments_file_content: Content of the instruments file
+    @param deadline: Seconds until the forecast has to be finished, late instruments get the error line
+    @param weather_budget: Seconds the weather may take at most, it's scraped alongside the instruments
+    @param history: Store for the quotes of the forecast, they aren't stored if omitted
+    @return: The forecast as Markdown
+    """
+    locations, cache_ttl_hours = weather_config(instruments_file_content)
+    with time_limit(deadline):
+        instrument_map, weather = run_async(
+            async_create_snapshot(
+                instruments_file_content, locations, cache_ttl_hours, weather_budget
+            )
+        )
+        # Sort by instrument priority
+        instruments = sorted(instrument_map.values(), key=lambda inst: inst.priority)
+        if history is not None:
+            with recorder.span("stage", stage="history"):
+                record_history(instrument_map, instruments_file_content, history)
+
+        with recorder.span("stage", stage="render"):
+            prose_lines = [
+                instrument.generate_prose_line(goethe) for instrument in instruments
+            ]
+            weather_line = render_weather_lines(
+                instruments_file_content["lines"], locations, weather
+            )
+            return goethe.talk_the_talk(prose_lines, weather_line)
+
+
+def stream_forecast(
+    goethe: ProseGenerator,
+    instruments_file_content: dict,
+    deadline: float | None = None,
+    weather_budget: float | None = None,
+):
+    """Streaming variant of 'render_forecast', yields the forecast again whenever instruments or the weather are done
+
+    The instruments and the weather are fetched in a background thread. Partial forecasts only contain the
+    instruments done so far (sorted by priority and then by the order of the instruments file, like the final one)
+    and an empty weather line until the weather is done. Instruments of faulty data provider modules aren't waited
+    for. Every prose line is generated once, so lines don't change their wording between the yields.
+    Instruments done at the same time are yielded as one batch.
+
+    @param goethe: ProseGenerator for the prose lines
+    @param instruments_file_content: Content of the instruments file
+    @param deadline: Seconds until the forecast has to be finished, late instruments get the error line
+    @param weather_budget: Seconds the weather may take at most, it's scraped alongside the instruments
+    @return: Generator of ForecastProgress, the last one is complete
+    """
+    lines = instruments_file_content["lines"]
+    locations, cache_ttl_hours = weather_config(instruments_file_content)
+    defaults = instruments_file_content.get("defaults", {})
+    # Priorities of the instruments not done yet, by key of 'async_create_instrument_map'
+    pending = {
+        (data_provider, position): {**defaults, **instrument}["priority"]
+        for data_provider, instruments_list in instruments_file_content[
+            "instruments"
+        ].items()
+        for position, instrument in enumerate(instruments_list or [])
+    }
+    # Lines of the same priority keep the order of the instruments file, like in the final forecast
+    file_order = {key: index for index, key in enumerate(pending)}
+    # Callbacks run on the event loop in the background thread
+    events = Queue()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast")
+    with time_limit(deadline):
+        snapshot_future = executor.submit(
+            copy_context().run,
+            run_async,
+            async_create_snapshot(
+                instruments_file_content,
+                locations,
+                cache_ttl_hours,
+                weather_budget,
+                on_created=lambda key, instrument: events.put(
+                    ("instrument", key, instrument)
+                ),
+                on_skipped=lambda key: events.put(("skipped", key)),
+                on_weather=lambda weather: events.put(("weather", weather)),
+            ),
+        )
+    snapshot_future.add_done_callback(lambda _: events.put(("done",)))
+    executor.shutdown(wait=False)
+
+    # Created instruments and their prose line by key
+    prose_lines = {}
+    weather_line = ""
+
+    def render(instruments: list) -> str:
+        return goethe.talk_the_talk(
+            [
+                prose_lines[key][1]
+                for key, _ in sorted(
+                    instruments,
+                    key=lambda item: (item[1].priority, file_order[item[0]]),
+                )
+            ],
+            weather_line,
+        )
+
+    done = False
+    while not done:
+        batch = [events.get()]
+        while not events.empty():
+            batch.append(events.get_nowait())
+        for event in batch:
+            if event[0] == "instrument":
+                _, key, instrument = event
+                pending.pop(key, None)
+                prose_lines[key] = (instrument, instrument.generate_prose_line(goethe))
+            elif event[0] == "skipped":
+                pending.pop(event[1], None)
+            elif event[0] == "weather":
+                weather_line = render_weather_lines(lines, locations, event[1])
+            else:
+                done = True
+        if not done:
+            yield ForecastProgress(
+                forecast=render(
+                    [(key, instrument) for key, (instrument, _) in prose_lines.items()]
+                ),
+                pending_priorities=sorted(pending.values()),
+                complete=False,
+            )
+
+    # Raises the errors of the background thread
+    instrument_map, weather = snapshot_future.result()
+    if history_store is not None:
+        with recorder.span("stage", stage="history"):
+            record_history(instrument_map, instruments_file_content, history_store)
+    with recorder.span("stage", stage="render"):
+        for key, instrument in instrument_map.items():
+            # Instruments which missed the deadline were only created afterwards
+            if key not in prose_lines or prose_lines[key][0] is not instrument:
+                prose_lines[key] = (instrument, instrument.generate_prose_line(goethe))
+        weather_line = render_weather_lines(lines, locations, weather)
+        forecast = render(list(instrument_map.items()))
+    yield ForecastProgress(forecast=forecast, pending_priorities=[], complete=True)
+
+
+def instrument_key(data_provider: str, complete_instrument: dict) -> tuple:
+    """What an instrument fetches, instruments with the same key in several configurations are fetched once"""
+    return (
+        data_provider,
+        complete_instrument.get("symbol"),
+        complete_instrument["url"],
+    )
+
+
+def merge_instruments_data(contents: list) -> tuple:
+    """Combine the instruments of several instruments files, each distinct instrument (see 'instrument_key') once
+
+    The first configuration wins for instruments and lines present in several of them, the lines of the combined
+    data are replaced per configuration when rendering anyway.
+
+    @param contents: Contents of instruments files with the defaults applied
+    @return: Tuple of the combined instruments data and a dict mapping the instrument keys to the keys of
+    'async_create_instrument_map'
+    """
+    merged_lines = {**contents[0]["lines"], "instruments": {}}
+    merged = {
+        "hedge_delay": contents[0].get("hedge_delay", default_hedge_delay),
+        "rate_limits": {},
+        "lines": merged_lines,
+        "instruments": {},
+    }
+    positions = {}
+    for content in contents:
+        for host, limit in (content.get("rate_limits") or {}).items():
+            merged["rate_limits"].setdefault(host, limit)
+        for instrument_type, line in content["lines"]["instruments"].items():
+            merged_lines["instruments"].setdefault(instrument_type, line)
+        # Stale instruments are only rendered with the stale line of the configurations having one
+        if merged_lines.get("stale") is None:
+            merged_lines["stale"] = content["lines"].get("stale")
+        for data_provider, instruments_list in content["instruments"].items():
+            for instrument in instruments_list or []:
+                key = instrument_key(data_provider, instrument)
+                if key in positions:
+                    continue
+                provider_list = merged["instruments"].setdefault(data_provider, [])
+                positions[key] = (data_provider, len(provider_list))
+                provider_list.append(instrument)
+    return merged, positions
+
+
+def retarget_instrument(
+    instrument: Instrument, complete_instrument: dict, lines: dict
+) -> Instrument:
+    """Copy an instrument created for another configuration with the details and lines of complete_instrument
+
+    The URL is kept, it's part of the instrument key or comes from the alternative the values were fetched from.
+    """
+    plural = complete_instrument["plural"]
+    is_stale = isinstance(instrument, StaleInstrument)
+    if instrument.values.absolute_value == error_value or (
+        is_stale and lines.get("stale") is None
+    ):
+        instrument_data = complete_instrument.copy()
+        instrument_data.pop("plural")
+        return create_error_instrument(instrument_data, plural, lines["error"])
+    if is_stale:
+        return attr.evolve(
+            instrument,
+            description=complete_instrument["description"],
+            type=complete_instrument["type"],
+            priority=complete_instrument["priority"],
+            line=Instrument.create_line(plural=plural, line=lines["stale"]),
+        )
+    return attr.evolve(
+        instrument,
+        description=complete_instrument["description"],
+        type=complete_instrument["type"],
+        priority=complete_instrument["priority"],
+        line=type(instrument).create_line(
+            plural=plural, line=lines["instruments"][complete_instrument["type"]]
+        ),
+    )
+
+
+def render_forecasts(
+    configs: list,
+    deadline: float | None = None,
+    weather_budget: float | None = None,
+) -> list:
+    """Create the forecasts of several configurations from one shared snapshot of the markets and the weather
+
+    Every distinct instrument is fetched exactly once (see 'merge_instruments_data'), no matter how many
+    configurations contain it. Each configuration is rendered with its own lines, descriptions and prose.
+
+    @param configs: Tuples of ProseGenerator and instruments file content, see 'load_config'
+    @param deadline: Seconds until the forecasts have to be finished, late instruments get the error line
+    @param weather_budget: Seconds the weather may take at most, it's scraped alongside the instruments
+    @return: The forecasts as Markdown, in the order of configs
+    """
+    contents = [instruments_file_content for _, instruments_file_content in configs]
+    merged, positions = merge_instruments_data(contents)
+    weather_configs = [weather_config(content) for content in contents]
+    # Every distinct location is scraped once, with the shortest cache TTL of all configurations
+    all_locations = [
+        location for locations, _ in weather_configs for location in locations
+    ]
+    cache_ttl_hours = min(cache_ttl_hours for _, cache_ttl_hours in weather_configs)
+
+    with time_limit(deadline):
+        snapshot, weather = run_async(
+            async_create_snapshot(
+                merged, all_locations, cache_ttl_hours, weather_budget
+            )
+        )
+        if history_store is not None:
+            with recorder.span("stage", stage="history"):
+                record_history(snapshot, merged, history_store)
+
+        forecasts = []
+        with recorder.span("stage", stage="render"):
+            for (goethe, instruments_file_content), (locations, _) in zip(
+                configs, weather_configs
+            ):
+                lines = instruments_file_content["lines"]
+                instruments = []
+                for data_provider, instruments_list in instruments_file_content[
+                    "instruments"
+                ].items():
+                    for instrument in instruments_list or []:
+                        created = snapshot.get(
+                            positions[instrument_key(data_provider, instrument)]
+                        )
+                        # Instruments of faulty data providers are left out
+                        if created is not None:
+                            instruments.append(
+                                retarget_instrument(created, instrument, lines)
+                            )
+                prose_lines = [
+                    instrument.generate_prose_line(goethe)
+                    for instrument in sorted(
+                        instruments, key=lambda inst: inst.priority
+                    )
+                ]
+                weather_line = render_weather_lines(lines, locations, weather)
+                forecasts.append(goethe.talk_the_talk(prose_lines, weather_line))
+        return forecasts
+
+
+def forecast(
+    instruments_file: str,
+    prose_file: str,
+    deadline: float | None = None,
+    weather_budget: float | None = None,
+):
+    """Create the complete forecast
+
+    @param instruments_file: YAML file with the instruments and lines
+    @param prose_file: YAML file with prose words
+    @param deadline: Seconds until the forecast has to be finished, late instruments get the error line
+    @param weather_budget: Seconds the weather may take at most, it's scraped alongside the instruments
+    @return: The forecast as Markdown
+    """
+    with time_limit(deadline):
+        goethe, instruments_file_content = load_config(instruments_file, prose_file)
+        return render_forecast(
+            goethe, instruments_file_content, deadline, weather_budget, history_store
+        )
+
+
+def weekly_summary(instruments_file: str, prose_file: str, today=None) -> str:
+    """Create the weekly summary from the stored quotes only, without any requests
+
+    Requires the history store (see 'configure_history'), the 'weekly' line of the instruments file and
+    'the_weekly_talk' of the prose file. Instruments without a week of history are left out. The values are
+    rendered like those of the data providers, e.g. with their currency.
+
+    @param instruments_file: YAML file with the instruments and lines
+    @param prose_file: YAML file with prose words
+    @param today: datetime.date the summary is created for, today by default
+    @return: The weekly summary as Markdown
+    """
+    if history_store is None:
+        raise ValueError("The weekly summary requires the history store.")
+    goethe, instruments_file_content = load_config(instruments_file, prose_file)
+    defaults = instruments_file_content.get("defaults", {})
+    # Tuples of the key of 'quote_key', the complete instrument and its ProviderInstrument class
+    instruments_data = []
+    for data_provider, instruments_list in instruments_file_content[
+        "instruments"
+    ].items():
+        try:
+            provider_instrument = getattr(
+                import_module(f"mswetterbericht.data_providers.{data_provider}"),
+                "ProviderInstrument",
+            )
+        except (ModuleNotFoundError, AttributeError) as e:
+            logger.error(
+                f"Skipping instruments of Data Provider '{data_provider}. Error was: '{e}'"
+            )
+            continue
+        for instrument in instruments_list or []:
+            complete_instrument = defaults.copy()
+            complete_instrument.update(instrument)
+            instruments_data.append(
+                (
+                    quote_key(data_provider, complete_instrument),
+                    complete_instrument,
+                    provider_instrument,
+                )
+            )
+
+    with recorder.span("stage", stage="history"):
+        changes = history_store.period_changes(
+            [key for key, _, _ in instruments_data], today
+        )
+    instruments = []
+    for key, instrument, provider_instrument in instruments_data:
+        instrument_changes = changes.get(key)
+        if instrument_changes is None or instrument_changes.week is None:
+            logger.warning(
+                f"Not enough history for '{instrument['description']}', leaving it out."
+            )
+            continue
+        instruments.append(
+            SummaryInstrument(
+                description=instrument["description"],
+                url=instrument["url"],
+                type=instrument["type"],
+                priority=instrument["priority"],
+                values=provider_instrument.create_values(
+                    pct_change=instrument_changes.week,
+                    absolute_value=instrument_changes.value,
+                ),
+                line=Instrument.create_line(
+                    line=instruments_file_content["lines"]["weekly"],
+                    plural=instrument["plural"],
+                ),
+                changes=instrument_changes,
+            )
+        )
+
+    with recorder.span("stage", stage="render"):
+        prose_lines = [
+            instrument.generate_prose_line(goethe)
+            for instrument in sorted(instruments, key=lambda inst: inst.priority)
+        ]
+        return goethe.talk_the_weekly_talk(prose_lines)
 
 
 if __name__ == "__main__":
     args = parse_args()
-    print(forecast(instruments_file=args.instruments_file, prose_file=args.prose_file))
+    try:
+        if args.command == "serve":
+            # Configures the caches of the module it imports, see 'daemon.serve'
+            from mswetterbericht.daemon import serve
+
+            serve(args)
+        elif args.command == "weekly":
+            configure_cache(args)
+            configure_scraper(args)
+            configure_history(args)
+            print(
+                weekly_summary(
+                    instruments_file=args.instruments_file, prose_file=args.prose_file
+                )
+            )
+        else:
+            configure_cache(args)
+            configure_scraper(args)
+            configure_history(args)
+            try:
+                print(
+                    forecast(
+                        instruments_file=args.instruments_file,
+                        prose_file=args.prose_file,
+                        deadline=args.deadline,
+                        weather_budget=args.weather_budget,
+                    )
+                )
+            finally:
+                write_metrics(args)
+    except ConfigError as e:
+        logger.critical(e)
+        exit(1)
+    if import_profiler is not None:
+        logger.info(import_profiler.report())
@@ -9,13 +9,26 @@ set -x
 CWD="${CWD:-${HOME}/src/mswetterbericht}"
 # Comment this out for testing
 SUBREDDIT="${SUBREDDIT:-carbonarastrasse}"
+# Targets file for posting to several subreddits at once, e.g. "files/targets.yaml" (optional, replaces SUBREDDIT)
+TARGETS_FILE="${TARGETS_FILE:-}"
+# URL of a running "wetterbericht.py serve" daemon, e.g. "unix:///run/mswetterbericht.sock" (optional)
+DAEMON_URL="${DAEMON_URL:-}"
+# Oldest forecast of the daemon in seconds which is posted, older ones are created locally (optional)
+DAEMON_MAX_AGE="${DAEMON_MAX_AGE:-}"
 
 run_mswetterbericht() {
+  local target_args=(--subreddit "${SUBREDDIT}")
+  if [ -n "${TARGETS_FILE}" ]
+  then
+    target_args=(--targets-file "${TARGETS_FILE}")
+  fi
   poetry run python mswetterbericht/pfostierer.py \
     --credentials-file "secret/praw-credentials.json" \
     --instruments-file "files/instruments.yaml" \
     --prose-file "files/prose.yaml" \
-    --subreddit "${SUBREDDIT}" \
+    "${target_args[@]}" \
+    ${DAEMON_URL:+--daemon-url "${DAEMON_URL}"} \
+    ${DAEMON_MAX_AGE:+--daemon-max-age "${DAEMON_MAX_AGE}"} \
   || return 1
 }
 
@@ -0,0 +1,72 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+from mswetterbericht import daemon, wetterbericht
+from mswetterbericht.lib import web
+from mswetterbericht.lib.last_known_good import LastKnownGoodStore
+
+prose_file = Path(__file__).parent.parent / "files" / "prose.yaml"
+
+instruments_yaml = """
+defaults:
+  plural: true
+  priority: 50
+  type: boring
+lines:
+  error: "* [{description}]({url}) machte/machten Probleme."
+  stale: "* [{description}]({url}) {verb} zuletzt **{change_word}** gewesen (Stand: {as_of})."
+  instruments:
+    boring: "* [{description}]({url}) {verb} **{change_word}**, mit **{pct_change}**."
+  weather: "* [Das Wetter in {location}]({url}) soll heute **{forecast}** werden."
+weather:
+  locations: []
+instruments:
+  cnbc:
+    - description: Schatzkistenerträge
+      symbol: US10Y
+      url: https://www.cnbc.com/quotes/US10Y
+"""
+
+
+@pytest.fixture
+def failing_daemon(tmp_path, monkeypatch):
+    """A daemon created like by 'wetterbericht.py serve', whose only instrument fails but has a stored quote"""
+    instruments_file = tmp_path / "instruments.yaml"
+    instruments_file.write_text(instruments_yaml)
+    history_dir = tmp_path / "history"
+    LastKnownGoodStore(path=history_dir / "last_known_good.sqlite").put_many(
+        {
+            "cnbc:US10Y": wetterbericht.InstrumentValues(
+                pct_change=1.5, absolute_value=3.8
+            )
+        }
+    )
+    # Nothing listens on the discard port, so the requests fail right away
+    monkeypatch.setitem(web.redirected_hosts, "quote.cnbc.com", "http://127.0.0.1:9")
+    monkeypatch.setattr(wetterbericht, "last_known_good_store", None)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "wetterbericht.py",
+            "serve",
+            f"--instruments-file={instruments_file}",
+            f"--prose-file={prose_file}",
+            f"--history-dir={history_dir}",
+            "--no-cache",
+        ],
+    )
+    yield daemon.create_daemon(wetterbericht.parse_args())
+    web.circuit_breaker.reset()
+
+
+def test_refresh_falls_back_to_last_known_good(failing_daemon):
+    failing_daemon.load_config()
+
+    assert failing_daemon.refresh() is True
+    assert "zuletzt" in failing_daemon.forecast
+    assert "Probleme" not in failing_daemon.forecast
+    assert failing_daemon.refresh_delay(stale=True) == daemon.stale_refresh_interval
+    assert failing_daemon.refresh_delay(stale=False) == failing_daemon.refresh_interval
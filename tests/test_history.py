@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+
+import pytest
+
+from mswetterbericht.lib.history import HistoryStore
+
+today = date(2026, 10, 16)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(directory=tmp_path)
+
+
+def test_period_changes_forward_fill(store):
+    # The last quote of the previous year is the reference for the YTD change
+    store.append("cnbc:US10Y", 50.0, date(2025, 12, 20))
+    store.append("cnbc:US10Y", 80.0, today - timedelta(days=40))
+    # Neither the week nor the month reference has a quote, the previous one is carried forward
+    store.append("cnbc:US10Y", 100.0, today - timedelta(days=9))
+    store.append("cnbc:US10Y", 110.0, today - timedelta(days=2))
+    # After the day the changes are calculated for, so the quote of two days ago is the current value
+    store.append("cnbc:US10Y", 999.0, today + timedelta(days=1))
+
+    changes = store.period_changes(["cnbc:US10Y"], today)["cnbc:US10Y"]
+    assert changes.value == 110.0
+    assert changes.week == 10.0
+    assert changes.month == 37.5
+    assert changes.ytd == 120.0
+    # Two daily returns aren't enough for the volatility
+    assert changes.volatility is None
+
+
+def test_period_changes_short_history(store):
+    store.append("cnbc:BTC.CM", 100.0, today - timedelta(days=3))
+    store.append("cnbc:BTC.CM", 105.0, today)
+
+    changes = store.period_changes(["cnbc:BTC.CM", "onvista:missing"], today)
+    assert list(changes) == ["cnbc:BTC.CM"]
+    assert changes["cnbc:BTC.CM"].value == 105.0
+    assert changes["cnbc:BTC.CM"].week is None
+    assert changes["cnbc:BTC.CM"].month is None
+    assert changes["cnbc:BTC.CM"].ytd is None
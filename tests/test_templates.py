@@ -0,0 +1,78 @@
+import pytest
+import upsidedown
+
+from mswetterbericht.data_providers.investing_com_investiny_upsidedown import (
+    UpsideDownLine,
+)
+from mswetterbericht.lib.templates import compile_template
+from mswetterbericht.wetterbericht import InstrumentLine
+
+# The upsidedown line of 'files/instruments.yaml', with a format spec and escaped braces in the transformed items
+upsidedown_lines = [
+    [
+        "* ",
+        "{verb} **{change_word}**, mit **{pct_change}** (Kurs: {absolute_value}).",
+        " [",
+        "{description}",
+        "]({url})",
+    ],
+    ["", "{{{description:>12}}} {verb} {change_word}!", " ({pct_change})"],
+]
+
+values = [
+    {
+        "description": "Der ASX 200",
+        "url": "https://www.investing.com/indices/aus-200",
+        "pct_change": "+0.42%",
+        "absolute_value": "7,123.5",
+    },
+    {
+        "description": "Ölpreis (Brent) {}",
+        "url": "https://www.cnbc.com/quotes/@LCO.1",
+        "pct_change": "-12.34%",
+        "absolute_value": "$1,234.0",
+    },
+]
+
+
+def render_upside_down(line: list, verb: str, change_word: str, **kwargs) -> str:
+    """Rendering of 'UpsideDownLine' before its items were compiled, formatting them on every call"""
+    rendered = []
+    for i, item in enumerate(line):
+        new_item = item.format(verb=verb, change_word=change_word, **kwargs)
+        # Transform every second item
+        rendered.append(upsidedown.transform(new_item) if i % 2 == 1 else new_item)
+    return "".join(rendered)
+
+
+@pytest.mark.parametrize("line", upsidedown_lines)
+@pytest.mark.parametrize("plural", [True, False])
+@pytest.mark.parametrize("instrument_values", values)
+def test_upside_down_line_equivalence(line, plural, instrument_values):
+    instrument_line = UpsideDownLine(line=line, plural=plural)
+    for change_word in ("leicht grün", "knallrot"):
+        assert instrument_line.generate_line(
+            change_word=change_word, **instrument_values
+        ) == render_upside_down(
+            line, instrument_line.verb, change_word, **instrument_values
+        )
+
+
+@pytest.mark.parametrize(
+    "template",
+    [
+        "* [{description}]({url}) {verb} **{change_word}**, mit **{pct_change}** (Kurs: {absolute_value}).",
+        "{{literal}} {description!r:^30} {pct_change:>8}",
+    ],
+)
+@pytest.mark.parametrize("instrument_values", values)
+def test_instrument_line_equivalence(template, instrument_values):
+    instrument_line = InstrumentLine(line=template, plural=True)
+    assert instrument_line.generate_line(
+        change_word="grün", **instrument_values
+    ) == template.format(verb="sind", change_word="grün", **instrument_values)
+
+
+def test_compile_template_rejects_positional_fields():
+    with pytest.raises(ValueError):
+        compile_template("{} {0}")
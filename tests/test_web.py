@@ -0,0 +1,87 @@
+from time import monotonic
+
+import pytest
+
+from mswetterbericht.lib import web
+
+url = "https://quote.cnbc.com/quote-html-webservice/restQuote/symbolType/symbol"
+
+
+class FakeClock:
+    """Replaces 'time.monotonic' of 'lib.web', time only passes via 'advance'"""
+
+    def __init__(self):
+        # Ahead of the real clock, so objects created with it aren't in the future
+        self.now = monotonic() + 1000
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(web, "monotonic", fake_clock)
+    return fake_clock
+
+
+def test_circuit_breaker_half_open(clock):
+    breaker = web.CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure(url)
+    breaker.check(url)
+    breaker.record_failure(url)
+    with pytest.raises(web.CircuitOpenError):
+        breaker.check(url)
+
+    clock.advance(30)
+    # Half open: a single request probes the host, the others keep failing fast
+    breaker.check(url)
+    with pytest.raises(web.CircuitOpenError):
+        breaker.check(url)
+
+    # A failed probe keeps the circuit open for another reset_timeout
+    breaker.record_failure(url)
+    clock.advance(29)
+    with pytest.raises(web.CircuitOpenError):
+        breaker.check(url)
+    clock.advance(1)
+    breaker.check(url)
+
+    # A successful probe closes the circuit and resets the failures
+    breaker.record_success(url)
+    breaker.check(url)
+    breaker.record_failure(url)
+    breaker.check(url)
+
+
+def test_circuit_breaker_per_host(clock):
+    breaker = web.CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure(url)
+    with pytest.raises(web.CircuitOpenError):
+        breaker.check(url)
+    breaker.check("https://www.investing.com/indices/germany-30-futures")
+
+
+def test_token_bucket_refill(clock):
+    bucket = web.TokenBucket(rate=2, burst=2)
+    # The burst is available at once, further requests queue up at the rate
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+    # Both queued requests got their tokens after a second
+    clock.advance(1)
+    assert bucket.reserve() == pytest.approx(0.5)
+    # Too long waits don't take a token
+    assert bucket.reserve(max_wait=0.5) is None
+    assert bucket.reserve(max_wait=1) == pytest.approx(1.0)
+
+    # Idle time refills up to the burst only
+    clock.advance(60)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)